@@ -12,7 +12,9 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Trusts exactly one proxy in front of the app (the platform router) for the
+# client address, scheme and host; with none or more than one, adjust the counts
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
 # Load configuration
 app.config.from_object('config.Config')
@@ -30,6 +32,14 @@ from routes.email import register_email_routes
 from routes.bot import register_bot_routes
 from routes.main import register_main_routes
 from utils.error_handler import register_error_handlers
+from utils.admission import register_admission_control
+from utils.usage_buffer import start_last_used_flusher
+from utils.logger import start_request_log_writer
+from utils.webhook_delivery import start_delivery_worker
+from utils.email_outbox import start_outbox_senders
+
+# Register admission control ahead of route dispatch
+register_admission_control(app)
 
 # Register routes
 register_api_routes(api)
@@ -39,6 +49,12 @@ register_bot_routes(app)
 register_main_routes(app)
 register_error_handlers(app)
 
+# Start background workers
+start_last_used_flusher(app)
+start_request_log_writer(app)
+start_delivery_worker(app)
+start_outbox_senders(app)
+
 # Import and register models
 from models import User, ApiKey
 
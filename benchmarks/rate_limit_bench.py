@@ -0,0 +1,52 @@
+"""
+Micro-benchmark for the rate limit storage
+
+Fills the store with N active clients and measures the cost of a hit for a
+random client. Per-hit latency should stay flat as N grows.
+
+Usage:
+    python benchmarks/rate_limit_bench.py [--hits 200000] [--url memory://?max_keys=10000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limit_storage import storage_from_url
+
+CLIENT_COUNTS = [10, 100, 1000, 10000, 100000, 1000000]
+
+def bench(url, clients, hits, limit=100, window=60):
+    """Return the mean nanoseconds per hit with the given number of active clients"""
+    store = storage_from_url(url)
+    store.reset()
+    now = time.time()
+    
+    for i in range(clients):
+        store.hit(f"ip:{i}", limit, window, now)
+    
+    keys = [f"ip:{random.randrange(clients)}" for _ in range(hits)]
+    
+    start = time.perf_counter()
+    for key in keys:
+        store.hit(key, limit, window, now)
+    elapsed = time.perf_counter() - start
+    
+    return elapsed / hits * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hits', type=int, default=200000, help='Timed hits per client count')
+    parser.add_argument('--url', default='memory://', help='Rate limit storage URL to benchmark')
+    args = parser.parse_args()
+    
+    print(f"storage: {args.url}")
+    print(f"{'clients':>10}  {'ns/hit':>10}")
+    for clients in CLIENT_COUNTS:
+        print(f"{clients:>10}  {bench(args.url, clients, args.hits):>10.0f}")
+
+if __name__ == '__main__':
+    main()
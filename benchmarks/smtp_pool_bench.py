@@ -0,0 +1,118 @@
+"""
+Benchmark for the pooled SMTP connections used by send_email
+
+Starts a local SMTP stand-in that adds a fixed latency to every command
+and sends N messages from T threads, first opening a connection per
+message (as send_email used to) and then over SMTPConnectionPool. Pooled
+sends should skip the greeting, EHLO, AUTH and QUIT round trips.
+
+Usage:
+    python benchmarks/smtp_pool_bench.py [--messages 500] [--threads 4] [--latency 0.005]
+"""
+import os
+import sys
+import time
+import smtplib
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.smtp_pool import SMTPConnectionPool
+
+MESSAGE = 'Subject: Benchmark\r\n\r\n' + 'Hello from the benchmark.\r\n' * 40
+
+class StandInHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib: EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+    
+    def reply(self, line):
+        time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b'\r\n')
+    
+    def handle(self):
+        self.server.count('connections')
+        self.reply('220 stand-in ready')
+        
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip().upper()
+            
+            if command.startswith(('EHLO', 'HELO')):
+                self.wfile.write(b'250-stand-in\r\n')
+                self.reply('250 AUTH PLAIN')
+            elif command.startswith('AUTH'):
+                self.reply('235 authenticated')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                self.server.count('messages')
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                # MAIL, RCPT, RSET and NOOP
+                self.reply('250 ok')
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.latency = latency
+        self.counters = {'connections': 0, 'messages': 0}
+        self._lock = threading.Lock()
+    
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+
+def send_fresh(port):
+    """Send one message the way send_email used to: connect, log in, send, quit"""
+    server = smtplib.SMTP('127.0.0.1', port)
+    server.login('bench', 'secret')
+    server.sendmail('bench@example.com', ['to@example.com'], MESSAGE)
+    server.quit()
+
+def bench(send, messages, threads):
+    """Return messages per second sending with the given function"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: send(), range(messages)))
+    
+    return messages / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500, help='Messages sent per run')
+    parser.add_argument('--threads', type=int, default=4, help='Concurrent senders, also the pool size')
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds the stand-in waits before each reply')
+    args = parser.parse_args()
+    
+    server = StandInServer(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    
+    print(f"{args.messages} messages, {args.threads} threads, {args.latency * 1000:.1f}ms per reply")
+    print(f"{'mode':>8}  {'msg/s':>8}  {'connections':>11}")
+    
+    server.counters['connections'] = 0
+    rate = bench(lambda: send_fresh(port), args.messages, args.threads)
+    print(f"{'fresh':>8}  {rate:>8.0f}  {server.counters['connections']:>11}")
+    
+    server.counters['connections'] = 0
+    pool = SMTPConnectionPool('127.0.0.1', port, username='bench', password='secret', max_size=args.threads)
+    rate = bench(lambda: pool.send('bench@example.com', ['to@example.com'], MESSAGE), args.messages, args.threads)
+    print(f"{'pooled':>8}  {rate:>8.0f}  {server.counters['connections']:>11}")
+    
+    pool.close()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
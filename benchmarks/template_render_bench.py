@@ -0,0 +1,70 @@
+"""
+Micro-benchmark for email template rendering
+
+Renders a template with V variables into bodies of growing size, once by
+calling str.replace per variable (as send_template used to) and once with
+the precompiled CompiledTemplate. Replacing costs O(variables x body) per
+send; the compiled render should grow with the body alone.
+
+Usage:
+    python benchmarks/template_render_bench.py [--variables 20] [--renders 200]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.template_renderer import CompiledTemplate
+
+BODY_SIZES = [1000, 10000, 100000, 1000000]
+
+def make_template(body_size, variable_count):
+    """Build a body of about body_size characters with placeholders spread evenly through it"""
+    names = [f"var{i}" for i in range(variable_count)]
+    filler = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. '
+    chunk = filler * max(body_size // (len(filler) * variable_count), 1)
+    body = ''.join(f"{chunk}{{{{{name}}}}} " for name in names)
+    variables = {name: f"value of {name}" for name in names}
+    
+    return 'Hello {{var0}}', body, variables
+
+def render_replace(subject, body, variables):
+    """The old rendering: one str.replace over subject and body per variable"""
+    for key, value in variables.items():
+        placeholder = f'{{{{{key}}}}}'
+        subject = subject.replace(placeholder, str(value))
+        body = body.replace(placeholder, str(value))
+    
+    return subject, body
+
+def bench(render, renders):
+    """Return the mean microseconds per render"""
+    start = time.perf_counter()
+    for _ in range(renders):
+        render()
+    
+    return (time.perf_counter() - start) / renders * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--variables', type=int, default=20, help='Placeholders in the template')
+    parser.add_argument('--renders', type=int, default=200, help='Timed renders per body size')
+    args = parser.parse_args()
+    
+    print(f"{args.variables} variables")
+    print(f"{'body':>10}  {'replace us':>12}  {'compiled us':>12}  {'compile us':>12}")
+    for body_size in BODY_SIZES:
+        subject, body, variables = make_template(body_size, args.variables)
+        
+        compile_us = bench(lambda: CompiledTemplate(subject, body), max(args.renders // 10, 1))
+        compiled = CompiledTemplate(subject, body)
+        assert compiled.render(variables)[:2] == render_replace(subject, body, variables)
+        
+        replace_us = bench(lambda: render_replace(subject, body, variables), args.renders)
+        compiled_us = bench(lambda: compiled.render(variables), args.renders)
+        print(f"{len(body):>10}  {replace_us:>12.1f}  {compiled_us:>12.1f}  {compile_us:>12.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -23,9 +23,50 @@ class Config:
     API_TITLE = 'API Gateway'
     API_VERSION = '1.0'
     
+    # Authentication settings
+    AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 10000))  # cached API keys
+    AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 60))  # seconds
+    ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', 900))  # seconds
+    ACCESS_TOKEN_REVOCATION_REFRESH = int(os.environ.get('ACCESS_TOKEN_REVOCATION_REFRESH', 5))  # seconds before revocations from other workers apply
+    API_KEY_USAGE_FLUSH_INTERVAL = int(os.environ.get('API_KEY_USAGE_FLUSH_INTERVAL', 10))  # seconds
+    
     # Rate limiting settings
-    RATELIMIT_DEFAULT = '100 per hour'
-    RATELIMIT_STORAGE_URL = 'memory://'
+    # Defaults apply unless a RateLimitPolicy row overrides them for a key,
+    # user or route. Routes are charged RATELIMIT_ROUTE_COSTS units per request.
+    RATELIMIT_DEFAULT = os.environ.get('RATELIMIT_DEFAULT', '100 per minute')
+    RATELIMIT_ANONYMOUS = os.environ.get('RATELIMIT_ANONYMOUS', '20 per minute')
+    RATELIMIT_ROUTE_COSTS = {
+        'email.send_email_api': 5,
+        'email.send_template': 5,
+        'email.send_template_bulk': 50,
+        'webhook.receive_webhooks_bulk': 10,
+    }
+    RATELIMIT_POLICY_REFRESH = int(os.environ.get('RATELIMIT_POLICY_REFRESH', 60))  # seconds
+    
+    # Admission control, applied to every /api/ request before authentication
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'True') == 'True'
+    ADMISSION_GLOBAL_LIMIT = os.environ.get('ADMISSION_GLOBAL_LIMIT', '1000 per second')
+    ADMISSION_IP_LIMIT = os.environ.get('ADMISSION_IP_LIMIT', '300 per minute')  # per client address, requests without credentials
+    ADMISSION_AUTH_FAILURE_LIMIT = os.environ.get('ADMISSION_AUTH_FAILURE_LIMIT', '20 per minute')
+    # memory:// (per worker), mmap:///path (shared by workers on one host)
+    # or redis://host:port/db (shared by all hosts; needs the redis package).
+    # memory://?max_keys=N caps memory under IP sprays by sketching the long tail.
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')
+    
+    # Inbound event deduplication. Keys come from the Idempotency-Key header or
+    # the payload field below; use a shared storage URL so all workers agree.
+    # Unset, it follows RATELIMIT_STORAGE_URL but never shares an mmap table
+    # with the rate limit counters (see utils/idempotency.py).
+    IDEMPOTENCY_STORAGE_URL = os.environ.get('IDEMPOTENCY_STORAGE_URL')
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 86400))  # seconds a key is remembered
+    WEBHOOK_IDEMPOTENCY_FIELD = os.environ.get('WEBHOOK_IDEMPOTENCY_FIELD', 'event_id')
+    
+    # Request logging settings (logs are written in batches by a background thread)
+    REQUEST_LOG_QUEUE_SIZE = int(os.environ.get('REQUEST_LOG_QUEUE_SIZE', 10000))
+    REQUEST_LOG_BATCH_SIZE = int(os.environ.get('REQUEST_LOG_BATCH_SIZE', 500))
+    REQUEST_LOG_FLUSH_INTERVAL = float(os.environ.get('REQUEST_LOG_FLUSH_INTERVAL', 2.0))  # seconds
+    REQUEST_LOG_OVERFLOW = os.environ.get('REQUEST_LOG_OVERFLOW', 'drop')  # drop, sample or block
+    REQUEST_LOG_SAMPLE_RATE = int(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 10))  # keep 1 in N when sampling
     
     # Email settings
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
@@ -34,10 +75,79 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME', '')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', '')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@example.com')
+    MAIL_TIMEOUT = float(os.environ.get('MAIL_TIMEOUT', 30))  # seconds per SMTP command
+    
+    # SMTP connection pool (logged-in connections reused across sends in a worker)
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', 4))  # connections per relay
+    MAIL_POOL_IDLE_TIMEOUT = int(os.environ.get('MAIL_POOL_IDLE_TIMEOUT', 60))  # seconds before an idle connection is closed
+    MAIL_POOL_CHECK_AFTER = int(os.environ.get('MAIL_POOL_CHECK_AFTER', 10))  # seconds idle before a NOOP check
+    MAIL_POOL_WAIT = int(os.environ.get('MAIL_POOL_WAIT', 10))  # seconds to wait for a free connection
+    
+    # Email outbox (messages are stored and sent by background senders)
+    MAIL_OUTBOX_SENDERS = int(os.environ.get('MAIL_OUTBOX_SENDERS', 4))  # sender threads per worker
+    MAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('MAIL_OUTBOX_POLL_INTERVAL', 1.0))  # seconds
+    MAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('MAIL_OUTBOX_BATCH_SIZE', 5))  # messages claimed at once per sender
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 6))
+    MAIL_RETRY_BASE_DELAY = int(os.environ.get('MAIL_RETRY_BASE_DELAY', 30))  # seconds, doubled per attempt
+    MAIL_RETRY_MAX_DELAY = int(os.environ.get('MAIL_RETRY_MAX_DELAY', 3600))  # seconds
+    MAIL_BULK_MAX_RECIPIENTS = int(os.environ.get('MAIL_BULK_MAX_RECIPIENTS', 10000))  # addresses (to, cc and bcc) per bulk request
+    MAIL_BULK_MAX_LINE = int(os.environ.get('MAIL_BULK_MAX_LINE', 65536))  # bytes per NDJSON line
+    MAIL_BULK_CHUNK_SIZE = int(os.environ.get('MAIL_BULK_CHUNK_SIZE', 500))  # messages per commit
+    
+    # Outbound rate per SMTP relay and worker: AIMD, halved on throttle replies and raised on every accepted message
+    MAIL_RATE_INITIAL = float(os.environ.get('MAIL_RATE_INITIAL', 5.0))  # messages per second
+    MAIL_RATE_MIN = float(os.environ.get('MAIL_RATE_MIN', 0.2))  # messages per second
+    MAIL_RATE_MAX = float(os.environ.get('MAIL_RATE_MAX', 50.0))  # messages per second
+    MAIL_RATE_INCREASE = float(os.environ.get('MAIL_RATE_INCREASE', 0.1))  # messages per second added per round of rate accepted messages
+    MAIL_RATE_DECREASE = float(os.environ.get('MAIL_RATE_DECREASE', 0.5))  # rate multiplier on a throttle reply
+    MAIL_RATE_BURST = int(os.environ.get('MAIL_RATE_BURST', 5))  # messages sent back to back before the rate applies
+    MAIL_RATE_MAX_WAIT = float(os.environ.get('MAIL_RATE_MAX_WAIT', 5))  # seconds a sender waits for the rate before deferring
+    MAIL_THROTTLE_CODES = tuple(int(code) for code in os.environ.get('MAIL_THROTTLE_CODES', '421,451').split(','))
+    MAIL_THROTTLE_RETRY_DELAY = int(os.environ.get('MAIL_THROTTLE_RETRY_DELAY', 15))  # seconds before a throttled message is retried
+    MAIL_THROTTLE_MAX_AGE = int(os.environ.get('MAIL_THROTTLE_MAX_AGE', 86400))  # seconds a message may keep waiting out throttles
+    
+    # Compiled email templates (entries are keyed by template version, so the TTL only bounds memory)
+    MAIL_TEMPLATE_CACHE_SIZE = int(os.environ.get('MAIL_TEMPLATE_CACHE_SIZE', 1000))  # compiled templates
+    MAIL_TEMPLATE_CACHE_TTL = int(os.environ.get('MAIL_TEMPLATE_CACHE_TTL', 3600))  # seconds
+    
+    # Outbound HTTP client (shared keep-alive connection pools for webhooks and bot calls)
+    HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 20))  # hosts kept pooled
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))  # idle connections kept per host
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))  # seconds
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))  # seconds
     
     # Webhook settings
     WEBHOOK_TIMEOUT = int(os.environ.get('WEBHOOK_TIMEOUT', 5))  # seconds
+    WEBHOOK_DISPATCH_WORKERS = int(os.environ.get('WEBHOOK_DISPATCH_WORKERS', 16))  # concurrent deliveries
+    WEBHOOK_DISPATCH_DEADLINE = int(os.environ.get('WEBHOOK_DISPATCH_DEADLINE', 10))  # seconds for the whole fan-out
+    WEBHOOK_BULK_MAX_EVENTS = int(os.environ.get('WEBHOOK_BULK_MAX_EVENTS', 10000))  # events per bulk request
+    WEBHOOK_BULK_MAX_LINE = int(os.environ.get('WEBHOOK_BULK_MAX_LINE', 262144))  # bytes per NDJSON line
+    WEBHOOK_BULK_MAX_ERRORS = int(os.environ.get('WEBHOOK_BULK_MAX_ERRORS', 100))  # rejected lines listed in the response
+    WEBHOOK_BULK_CHUNK_SIZE = int(os.environ.get('WEBHOOK_BULK_CHUNK_SIZE', 500))  # events per commit
+    WEBHOOK_ROUTES_REFRESH = int(os.environ.get('WEBHOOK_ROUTES_REFRESH', 30))  # seconds before other workers' changes are seen
+    
+    # Webhook delivery queue (deliveries are stored and sent by a background worker)
+    WEBHOOK_DELIVERY_POLL_INTERVAL = float(os.environ.get('WEBHOOK_DELIVERY_POLL_INTERVAL', 1.0))  # seconds
+    WEBHOOK_DELIVERY_BATCH_SIZE = int(os.environ.get('WEBHOOK_DELIVERY_BATCH_SIZE', 50))  # requests claimed at once; a batch counts as one
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 8))
+    WEBHOOK_RETRY_BASE_DELAY = int(os.environ.get('WEBHOOK_RETRY_BASE_DELAY', 5))  # seconds, doubled per attempt
+    WEBHOOK_RETRY_MAX_DELAY = int(os.environ.get('WEBHOOK_RETRY_MAX_DELAY', 3600))  # seconds
+    
+    WEBHOOK_BATCH_MAX_SIZE = int(os.environ.get('WEBHOOK_BATCH_MAX_SIZE', 1000))  # largest batch an endpoint may ask for
+    WEBHOOK_BATCH_MAX_LINGER = int(os.environ.get('WEBHOOK_BATCH_MAX_LINGER', 300))  # seconds
+    
+    # Fair scheduling of deliveries across users (deficit round robin)
+    WEBHOOK_FAIR_QUANTUM = int(os.environ.get('WEBHOOK_FAIR_QUANTUM', 5))  # deliveries a user earns per round
+    WEBHOOK_TENANT_WEIGHTS = {}  # user id -> weight; users not listed weigh 1
+    WEBHOOK_USER_CONCURRENCY = int(os.environ.get('WEBHOOK_USER_CONCURRENCY', 10))  # in-flight requests per user, all workers; a batch counts as one
+    WEBHOOK_HOST_CONCURRENCY = int(os.environ.get('WEBHOOK_HOST_CONCURRENCY', 8))  # concurrent requests per destination host per worker
+    
+    # Per-endpoint circuit breaker
+    WEBHOOK_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('WEBHOOK_BREAKER_FAILURE_THRESHOLD', 5))  # consecutive failures
+    WEBHOOK_BREAKER_COOLDOWN = int(os.environ.get('WEBHOOK_BREAKER_COOLDOWN', 60))  # seconds before a probe is sent
+    WEBHOOK_AUTO_DISABLE_AFTER = int(os.environ.get('WEBHOOK_AUTO_DISABLE_AFTER', 86400))  # seconds of failures; 0 to never disable
     
     # Bot integration settings
     BOT_TOKEN = os.environ.get('BOT_TOKEN', '')
     BOT_API_BASE_URL = os.environ.get('BOT_API_BASE_URL', '')
+    BOT_TIMEOUT = float(os.environ.get('BOT_TIMEOUT', 10))  # seconds
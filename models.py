@@ -58,6 +58,21 @@ class ApiKey(db.Model):
         return f'<ApiKey {self.name}>'
 
 
+class TokenRevocation(db.Model):
+    """Point in time before which access tokens for an API key or user are rejected"""
+    
+    KIND_KEY = 'key'
+    KIND_USER = 'user'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(8), nullable=False)
+    ident = db.Column(db.Integer, nullable=False)
+    revoked_at = db.Column(db.Integer, nullable=False, index=True)  # Unix time, compared with the token's iat
+    
+    def __repr__(self):
+        return f'<TokenRevocation {self.kind} {self.ident}>'
+
+
 class WebhookEndpoint(db.Model):
     """Webhook endpoint configuration for receiving and dispatching webhooks"""
     
@@ -66,14 +81,90 @@ class WebhookEndpoint(db.Model):
     url = db.Column(db.String(256), nullable=False)
     secret = db.Column(db.String(64), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    events = db.Column(db.String(256), nullable=False)  # Comma-separated list of events
+    events = db.Column(db.String(256), nullable=False)  # Comma-separated list of events, as submitted
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     
+    # Batched delivery: events are sent as JSON arrays once batch_max_size have
+    # queued up or the oldest has waited batch_linger seconds. None sends one per request.
+    batch_max_size = db.Column(db.Integer, nullable=True)
+    batch_linger = db.Column(db.Float, nullable=False, default=5.0)
+    
+    # Delivery health, maintained by the delivery worker
+    circuit_state = db.Column(db.String(16), nullable=False, default='closed')  # closed, open or half_open
+    circuit_opened_at = db.Column(db.DateTime, nullable=True)
+    consecutive_failures = db.Column(db.Integer, nullable=False, default=0)
+    failing_since = db.Column(db.DateTime, nullable=True)
+    success_rate = db.Column(db.Float, nullable=False, default=1.0)  # Moving average of delivery outcomes
+    latency_ewma = db.Column(db.Float, nullable=True)  # seconds
+    last_success_at = db.Column(db.DateTime, nullable=True)
+    last_failure_at = db.Column(db.DateTime, nullable=True)
+    disabled_reason = db.Column(db.String(128), nullable=True)
+    
+    subscriptions = db.relationship('WebhookSubscription', backref='webhook', cascade='all, delete-orphan')
+    
     def __repr__(self):
         return f'<WebhookEndpoint {self.name}>'
 
 
+class WebhookSubscription(db.Model):
+    """Event type, or pattern such as order.*, that a webhook endpoint receives"""
+    
+    id = db.Column(db.Integer, primary_key=True)
+    webhook_id = db.Column(db.Integer, db.ForeignKey('webhook_endpoint.id'), nullable=False, index=True)
+    event_type = db.Column(db.String(128), nullable=False, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('webhook_id', 'event_type', name='uq_webhook_subscription'),
+    )
+    
+    def __repr__(self):
+        return f'<WebhookSubscription {self.webhook_id} {self.event_type}>'
+
+
+class WebhookEvent(db.Model):
+    """Inbound webhook event, stored once and shared by all of its deliveries"""
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(128), nullable=False)
+    body = db.Column(db.Text, nullable=False)  # Exact JSON sent (and signed) for every endpoint
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<WebhookEvent {self.id} {self.event_type}>'
+
+
+class WebhookDelivery(db.Model):
+    """Queued delivery of one webhook event to one endpoint"""
+    
+    STATUS_PENDING = 'pending'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_DEAD = 'dead'  # Gave up after the maximum number of attempts
+    
+    id = db.Column(db.Integer, primary_key=True)
+    webhook_id = db.Column(db.Integer, db.ForeignKey('webhook_endpoint.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('webhook_event.id'), nullable=False, index=True)
+    event = db.Column(db.String(128), nullable=False)
+    webhook_event = db.relationship('WebhookEvent')
+    status = db.Column(db.String(16), nullable=False, default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    claimed_by = db.Column(db.String(64), nullable=True)  # Worker currently sending it
+    locked_until = db.Column(db.DateTime, nullable=True)  # Claim expiry, in case that worker dies
+    last_status_code = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.String(256), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_webhook_delivery_due', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<WebhookDelivery {self.id} {self.status}>'
+
+
 class EmailTemplate(db.Model):
     """Email template model for storing reusable email templates"""
     
@@ -82,12 +173,62 @@ class EmailTemplate(db.Model):
     subject = db.Column(db.String(128), nullable=False)
     body = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped whenever subject or body changes
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
     def __repr__(self):
         return f'<EmailTemplate {self.name}>'
 
 
+class EmailMessage(db.Model):
+    """Outbound email queued for a background sender"""
+    
+    STATUS_QUEUED = 'queued'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'  # Refused by the relay, or gave up after the maximum number of attempts
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    template_id = db.Column(db.Integer, db.ForeignKey('email_template.id', ondelete='SET NULL'), nullable=True)
+    recipients = db.Column(db.Text, nullable=False)  # JSON object with to, cc and bcc lists, plus pending, delivered and refused after a partial refusal
+    reply_to = db.Column(db.String(256), nullable=True)
+    subject = db.Column(db.String(998), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    html = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default=STATUS_QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    claimed_by = db.Column(db.String(64), nullable=True)  # Worker currently sending it
+    locked_until = db.Column(db.DateTime, nullable=True)  # Claim expiry, in case that worker dies
+    last_smtp_code = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.String(256), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_email_message_due', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<EmailMessage {self.id} {self.status}>'
+
+
+class RateLimitPolicy(db.Model):
+    """Rate limit policy overriding the defaults for an API key, a user or a route"""
+    
+    # Exactly one of api_key_id, user_id or endpoint says what the policy applies to
+    id = db.Column(db.Integer, primary_key=True)
+    api_key_id = db.Column(db.Integer, db.ForeignKey('api_key.id'), nullable=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    endpoint = db.Column(db.String(128), nullable=True, index=True)  # Flask endpoint name, e.g. email.send_email_api
+    limit = db.Column(db.String(64), nullable=True)  # e.g. "1000 per hour"; per caller for route policies
+    cost = db.Column(db.Integer, nullable=True)  # Route policies: units charged per request
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RateLimitPolicy {self.id}>'
+
+
 class RequestLog(db.Model):
     """Request log model for tracking API requests"""
     
@@ -103,3 +244,27 @@ class RequestLog(db.Model):
     
     def __repr__(self):
         return f'<RequestLog {self.method} {self.endpoint} {self.status_code}>'
+
+
+class RequestRollup(db.Model):
+    """Per-minute request aggregates maintained incrementally from request logs"""
+    
+    # Each worker writes its own partial row per key and minute; readers sum them
+    id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, nullable=False, index=True)  # Start of the minute (UTC)
+    method = db.Column(db.String(10), nullable=False)
+    endpoint = db.Column(db.String(256), nullable=False)  # Route pattern, e.g. /api/keys/<int:key_id>
+    status_class = db.Column(db.String(3), nullable=False)  # 2xx, 4xx, 5xx...
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    latency_sum = db.Column(db.Float, nullable=False, default=0.0)
+    latency_max = db.Column(db.Float, nullable=False, default=0.0)
+    histogram = db.Column(db.Text, nullable=False)  # JSON list of counts per latency bucket
+    
+    __table_args__ = (
+        db.Index('ix_request_rollup_user_bucket', 'user_id', 'bucket'),
+    )
+    
+    def __repr__(self):
+        return f'<RequestRollup {self.bucket} {self.method} {self.endpoint} {self.status_class}>'
@@ -1,11 +1,23 @@
 from flask import request, jsonify, g
 from flask_restful import Resource, reqparse
+import time
 import datetime
 import logging
-from utils.auth import auth_required
-from utils.rate_limit import rate_limit
-from utils.logger import log_request
-from models import db, User, ApiKey
+from utils.auth import auth_required, invalidate_api_key, get_auth_cache_stats
+from utils.rate_limit import rate_limit, get_rate_limit_store
+from utils.logger import log_request, get_request_log_stats
+from utils.usage_buffer import last_used_buffer
+from utils.tokens import issue_access_token, revoke_api_key_tokens, revocation_list
+from utils.admission import get_admission_stats
+from utils.analytics import rollup_aggregator, summarize_rollups
+from utils.http_client import get_http_client_stats
+from utils.smtp_pool import get_smtp_pool_stats
+from utils.smtp_rate import get_relay_rate_stats
+from utils.template_renderer import get_template_cache_stats
+from utils.webhook_routing import event_router
+from utils.idempotency import get_idempotency_stats
+from utils.webhook_scheduler import fair_scheduler
+from models import db, User, ApiKey, RequestRollup
 
 logger = logging.getLogger(__name__)
 
@@ -104,8 +116,11 @@ class ApiKeyDetailResource(Resource):
         
         api_key.name = args['name']
         api_key.is_active = args['is_active']
+        if not api_key.is_active:
+            revoke_api_key_tokens(api_key.id)
         
         db.session.commit()
+        invalidate_api_key(api_key.key)
         
         return jsonify({
             'status': 'success',
@@ -131,8 +146,11 @@ class ApiKeyDetailResource(Resource):
                 'message': 'API key not found'
             }), 404
         
+        key, key_id = api_key.key, api_key.id
         db.session.delete(api_key)
+        revoke_api_key_tokens(key_id)
         db.session.commit()
+        invalidate_api_key(key)
         
         return jsonify({
             'status': 'success',
@@ -140,6 +158,33 @@ class ApiKeyDetailResource(Resource):
         })
 
 
+class AccessTokenResource(Resource):
+    """Resource for exchanging an API key for a short-lived access token"""
+    
+    @auth_required
+    @rate_limit
+    @log_request
+    def post(self):
+        """Issue a signed access token for the API key used in this request"""
+        if g.auth_type != 'api_key':
+            return jsonify({
+                'status': 'error',
+                'message': 'Access tokens can only be issued for an API key'
+            }), 400
+        
+        token, expires_at = issue_access_token(g.user.id, g.user.api_key_id)
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'access_token': token,
+                'token_type': 'Bearer',
+                'expires_in': expires_at - int(time.time()),
+                'expires_at': datetime.datetime.utcfromtimestamp(expires_at).isoformat()
+            }
+        }), 201
+
+
 class HealthCheckResource(Resource):
     """Resource for checking API health"""
     
@@ -152,8 +197,86 @@ class HealthCheckResource(Resource):
         })
 
 
+class StatsResource(Resource):
+    """Resource for querying pre-aggregated request statistics"""
+    
+    @auth_required
+    @rate_limit
+    @log_request
+    def get(self):
+        """
+        Get per-endpoint request counts, errors and latency percentiles for the authenticated user
+        
+        Requests this worker has logged, up to the current minute, are merged
+        in as each log batch is written (every REQUEST_LOG_FLUSH_INTERVAL
+        seconds). Requests served by other workers appear once their minute
+        is over and written, so they can lag by up to a minute.
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument('minutes', type=int, default=60, location='args', help='Look-back window in minutes')
+        parser.add_argument('endpoint', location='args', help='Route pattern, e.g. /api/email/send')
+        parser.add_argument('method', location='args', help='HTTP method')
+        args = parser.parse_args()
+        
+        minutes = max(1, min(args['minutes'], 7 * 24 * 60))
+        since = datetime.datetime.utcnow().replace(second=0, microsecond=0) - datetime.timedelta(minutes=minutes)
+        
+        query = RequestRollup.query.filter(
+            RequestRollup.user_id == g.user.id,
+            RequestRollup.bucket >= since
+        )
+        pending = rollup_aggregator.pending_rows(g.user.id, since)
+        if args['endpoint']:
+            query = query.filter(RequestRollup.endpoint == args['endpoint'])
+            pending = [row for row in pending if row.endpoint == args['endpoint']]
+        if args['method']:
+            query = query.filter(RequestRollup.method == args['method'].upper())
+            pending = [row for row in pending if row.method == args['method'].upper()]
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'since': since.isoformat(),
+                'minutes': minutes,
+                'endpoints': summarize_rollups(query.all() + pending)
+            }
+        })
+
+
+class MetricsResource(Resource):
+    """Resource for inspecting in-process gateway metrics"""
+    
+    @auth_required
+    @rate_limit
+    @log_request
+    def get(self):
+        """Get cache and counter metrics for this worker"""
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'auth_cache': get_auth_cache_stats(),
+                'api_key_usage': last_used_buffer.stats(),
+                'revoked_tokens': len(revocation_list),
+                'rate_limit': get_rate_limit_store().stats(),
+                'admission': get_admission_stats(),
+                'request_log': get_request_log_stats(),
+                'rollups': rollup_aggregator.stats(),
+                'http_client': get_http_client_stats(),
+                'smtp_pool': get_smtp_pool_stats(),
+                'smtp_rate': get_relay_rate_stats(),
+                'email_templates': get_template_cache_stats(),
+                'webhook_routes': event_router.stats(),
+                'idempotency': get_idempotency_stats(),
+                'webhook_scheduler': fair_scheduler.stats()
+            }
+        })
+
+
 def register_api_routes(api):
     """Register all API routes"""
     api.add_resource(HealthCheckResource, '/api/health')
     api.add_resource(ApiKeyResource, '/api/keys')
+    api.add_resource(AccessTokenResource, '/api/keys/token')
     api.add_resource(ApiKeyDetailResource, '/api/keys/<int:key_id>')
+    api.add_resource(StatsResource, '/api/stats')
+    api.add_resource(MetricsResource, '/api/metrics')
@@ -6,6 +6,8 @@ from models import db
 from utils.auth import auth_required
 from utils.rate_limit import rate_limit
 from utils.logger import log_request
+from utils.http_client import get_http_session, get_timeout
+from utils.idempotency import get_idempotency_key, claim_idempotency_key, release_idempotency_key
 
 logger = logging.getLogger(__name__)
 bot_bp = Blueprint('bot', __name__, url_prefix='/api/bot')
@@ -54,10 +56,11 @@ def send_message():
     
     try:
         # Send message to bot API
-        response = requests.post(
+        response = get_http_session().post(
             f"{api_base_url}/chat.postMessage",
             json=payload,
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json'},
+            timeout=get_timeout(current_app.config.get('BOT_TIMEOUT'))
         )
         
         response_data = response.json()
@@ -105,9 +108,10 @@ def get_channels():
     
     try:
         # Get channels from bot API
-        response = requests.get(
+        response = get_http_session().get(
             f"{api_base_url}/conversations.list",
-            params={'token': bot_token, 'types': 'public_channel,private_channel'}
+            params={'token': bot_token, 'types': 'public_channel,private_channel'},
+            timeout=get_timeout(current_app.config.get('BOT_TIMEOUT'))
         )
         
         response_data = response.json()
@@ -158,24 +162,37 @@ def receive_webhook():
         return jsonify({'challenge': data.get('challenge')})
     
     elif event_type == 'event_callback':
-        # Handle event callback
-        event = data.get('event', {})
-        event_type = event.get('type')
-        
-        # Log the event
-        logger.info(f"Received bot event: {event_type}")
+        # The platform retries events it thinks timed out; handle each event_id once
+        idempotency_key = get_idempotency_key(data, 'event_id')
+        if not claim_idempotency_key('bot', idempotency_key):
+            return jsonify({
+                'status': 'success',
+                'message': 'Duplicate event ignored'
+            })
         
-        # Process event (implement your logic here)
-        # For example, if it's a message event:
-        if event_type == 'message':
-            channel = event.get('channel')
-            text = event.get('text')
-            user = event.get('user')
-            
-            logger.info(f"Received message from {user} in {channel}: {text}")
+        try:
+            # Handle event callback
+            event = data.get('event', {})
+            event_type = event.get('type')
             
-            # Process the message (implement your logic here)
+            # Log the event
+            logger.info(f"Received bot event: {event_type}")
             
+            # Process event (implement your logic here)
+            # For example, if it's a message event:
+            if event_type == 'message':
+                channel = event.get('channel')
+                text = event.get('text')
+                user = event.get('user')
+                
+                logger.info(f"Received message from {user} in {channel}: {text}")
+                
+                # Process the message (implement your logic here)
+        except Exception:
+            # Let the platform's retry of an event that failed through
+            release_idempotency_key('bot', idempotency_key)
+            raise
+        
         return jsonify({
             'status': 'success',
             'message': 'Event received'
@@ -1,15 +1,67 @@
+import json
 import logging
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, current_app
 from werkzeug.exceptions import BadRequest
-from models import db, EmailTemplate
+from models import db, EmailTemplate, EmailMessage
 from utils.auth import auth_required
 from utils.rate_limit import rate_limit
 from utils.logger import log_request
-from utils.email_service import send_email
+from utils.email_outbox import as_list, queue_email, add_email
+from utils.ndjson import read_ndjson
+from utils.template_renderer import get_compiled_template, invalidate_template
 
 logger = logging.getLogger(__name__)
 email_bp = Blueprint('email', __name__, url_prefix='/api/email')
 
+# Longest address allowed in a path (RFC 5321); also fits the reply_to column
+MAX_ADDRESS_LENGTH = 254
+
+def check_addresses(value, name):
+    """
+    Check an address or list of addresses from a request body
+    
+    Returns:
+        str: What is wrong with the value, or None if it is usable
+    """
+    addresses = value if isinstance(value, list) else [value]
+    if not all(isinstance(address, str) and address for address in addresses):
+        return f'"{name}" must be an address or list of addresses'
+    if any(len(address) > MAX_ADDRESS_LENGTH for address in addresses):
+        return f'Addresses in "{name}" must be at most {MAX_ADDRESS_LENGTH} characters'
+    
+    return None
+
+def serialize_message(message):
+    """Describe a queued email message"""
+    recipients = json.loads(message.recipients)
+    
+    return {
+        'id': message.id,
+        'template_id': message.template_id,
+        'to': recipients['to'],
+        'subject': message.subject,
+        'status': message.status,
+        'attempts': message.attempts,
+        'next_attempt_at': message.next_attempt_at.isoformat() if message.status == EmailMessage.STATUS_QUEUED else None,
+        'last_smtp_code': message.last_smtp_code,
+        'last_error': message.last_error,
+        'refused': recipients.get('refused', {}),
+        'created_at': message.created_at.isoformat(),
+        'sent_at': message.sent_at.isoformat() if message.sent_at else None
+    }
+
+def queued_response(message, **extra):
+    """202 response for a message handed to the outbox"""
+    return jsonify({
+        'status': 'success',
+        'message': 'Email queued for sending',
+        'data': dict({
+            'id': message.id,
+            'status': message.status
+        }, **extra)
+    }), 202
+
+
 @email_bp.route('/send', methods=['POST'])
 @auth_required
 @rate_limit
@@ -36,20 +88,10 @@ def send_email_api():
     bcc = data.get('bcc', [])
     reply_to = data.get('reply_to')
     
-    # Send email
-    result = send_email(to, subject, body, html, cc, bcc, reply_to)
+    # Queue email; background senders deliver it
+    message = queue_email(g.user.id, to, subject, body, html, cc, bcc, reply_to)
     
-    if result['status'] == 'success':
-        return jsonify({
-            'status': 'success',
-            'message': 'Email sent successfully'
-        })
-    else:
-        return jsonify({
-            'status': 'error',
-            'message': 'Failed to send email',
-            'error': result['error']
-        }), 500
+    return queued_response(message)
 
 
 @email_bp.route('/templates', methods=['GET'])
@@ -159,10 +201,13 @@ def update_template(template_id):
     # Update template fields
     if 'name' in data:
         template.name = data['name']
-    if 'subject' in data:
-        template.subject = data['subject']
-    if 'body' in data:
-        template.body = data['body']
+    if 'subject' in data or 'body' in data:
+        template.subject = data.get('subject', template.subject)
+        template.body = data.get('body', template.body)
+        # A new version is compiled on its next send, in every worker. The
+        # increment happens in SQL, so concurrent edits each get their own version
+        invalidate_template(template.id, template.version)
+        template.version = EmailTemplate.version + 1
     
     db.session.commit()
     
@@ -191,6 +236,7 @@ def delete_template(template_id):
             'message': 'Email template not found'
         }), 404
     
+    invalidate_template(template.id, template.version)
     db.session.delete(template)
     db.session.commit()
     
@@ -206,7 +252,7 @@ def delete_template(template_id):
 @log_request
 def send_template(template_id):
     """Send an email using a template"""
-    template = EmailTemplate.query.filter_by(id=template_id, user_id=g.user.id).first()
+    template = get_compiled_template(template_id, g.user.id)
     
     if not template:
         return jsonify({
@@ -229,31 +275,139 @@ def send_template(template_id):
     bcc = data.get('bcc', [])
     reply_to = data.get('reply_to')
     
-    # Process template variables
-    subject = template.subject
-    body = template.body
+    variables = data.get('variables', {})
+    if not isinstance(variables, dict):
+        raise BadRequest('variables must be an object')
     
     # Replace variables in subject and body
-    variables = data.get('variables', {})
-    for key, value in variables.items():
-        placeholder = f'{{{{{key}}}}}'
-        subject = subject.replace(placeholder, str(value))
-        body = body.replace(placeholder, str(value))
+    rendered = template.render(variables)
+    
+    # Queue email; background senders deliver it
+    message = queue_email(
+        g.user.id, to, rendered.subject, rendered.body, rendered.body, cc, bcc, reply_to, template_id=template_id
+    )
+    
+    return queued_response(message, missing_variables=rendered.missing, unknown_variables=rendered.unknown)
+
+
+@email_bp.route('/send-template/<int:template_id>/bulk', methods=['POST'])
+@auth_required
+@rate_limit
+@log_request
+def send_template_bulk(template_id):
+    """
+    Queue one email per recipient from a template
     
-    # Send email
-    result = send_email(to, subject, body, body, cc, bcc, reply_to)
+    The body is newline-delimited JSON, one recipient per line: an object with
+    "to", optional "variables" and optional "cc", "bcc" and "reply_to". The
+    template is loaded once, lines are read and committed in chunks, and the
+    response lists the queued message id (or the error) for every line, and
+    any placeholders a recipient's variables left unfilled.
+    """
+    template = get_compiled_template(template_id, g.user.id)
     
-    if result['status'] == 'success':
+    if not template:
         return jsonify({
-            'status': 'success',
-            'message': 'Email sent successfully'
-        })
-    else:
+            'status': 'error',
+            'message': 'Email template not found'
+        }), 404
+    
+    config = current_app.config
+    max_recipients = config.get('MAIL_BULK_MAX_RECIPIENTS', 10000)
+    chunk_size = config.get('MAIL_BULK_CHUNK_SIZE', 500)
+    summary = {'recipients': 0, 'queued': 0, 'rejected': 0, 'incomplete': 0}
+    results = []
+    pending = []  # (result, message) pairs not committed yet
+    
+    def reject(line_number, message):
+        summary['rejected'] += 1
+        results.append({'line': line_number, 'status': 'rejected', 'error': message})
+    
+    def commit_chunk():
+        # Flushing assigns the ids without reloading every row after the commit
+        db.session.flush()
+        for result, message in pending:
+            result['id'] = message.id
+        db.session.commit()
+        pending.clear()
+    
+    for line_number, item, error in read_ndjson(request.stream, config.get('MAIL_BULK_MAX_LINE', 65536)):
+        if error:
+            reject(line_number, error)
+            continue
+        
+        to = item.get('to') if isinstance(item, dict) else None
+        if not to or check_addresses(to, 'to'):
+            reject(line_number, 'Each line needs a "to" address or list of addresses')
+            continue
+        
+        cc, bcc, reply_to = item.get('cc'), item.get('bcc'), item.get('reply_to')
+        problem = (cc and check_addresses(cc, 'cc')) or (bcc and check_addresses(bcc, 'bcc'))
+        if not problem and reply_to is not None:
+            problem = check_addresses(reply_to, 'reply_to') if isinstance(reply_to, str) else '"reply_to" must be a single address'
+        if problem:
+            reject(line_number, problem)
+            continue
+        
+        variables = item.get('variables', {})
+        if not isinstance(variables, dict):
+            reject(line_number, '"variables" must be an object')
+            continue
+        
+        # The limit is on addresses, so a line with a long "to" list can't get around it
+        addresses = len(as_list(to)) + len(as_list(cc)) + len(as_list(bcc))
+        if summary['recipients'] + addresses > max_recipients:
+            reject(line_number, f'More than {max_recipients} recipients; the rest of the body was ignored')
+            break
+        summary['recipients'] += addresses
+        
+        rendered = template.render(variables)
+        message = add_email(
+            g.user.id, to, rendered.subject, rendered.body, rendered.body,
+            cc, bcc, reply_to, template_id=template_id
+        )
+        
+        result = {'line': line_number, 'to': to, 'status': EmailMessage.STATUS_QUEUED}
+        if rendered.missing:
+            result['missing_variables'] = rendered.missing
+            summary['incomplete'] += 1
+        if rendered.unknown:
+            result['unknown_variables'] = rendered.unknown
+        results.append(result)
+        pending.append((result, message))
+        summary['queued'] += 1
+        
+        if len(pending) >= chunk_size:
+            commit_chunk()
+    
+    if pending:
+        commit_chunk()
+    
+    return jsonify({
+        'status': 'success',
+        'message': 'Emails queued for sending',
+        'data': dict(summary, results=results)
+    }), 202
+
+
+@email_bp.route('/messages/<int:message_id>', methods=['GET'])
+@auth_required
+@rate_limit
+@log_request
+def get_message(message_id):
+    """Get the status of a queued email message"""
+    message = EmailMessage.query.filter_by(id=message_id, user_id=g.user.id).first()
+    
+    if not message:
         return jsonify({
             'status': 'error',
-            'message': 'Failed to send email',
-            'error': result['error']
-        }), 500
+            'message': 'Email message not found'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'data': serialize_message(message)
+    })
 
 
 def register_email_routes(app):
@@ -1,18 +1,75 @@
-import json
-import hmac
-import hashlib
-import requests
+import click
 import logging
+import datetime
 from flask import Blueprint, request, jsonify, g, current_app
 from werkzeug.exceptions import BadRequest
-from models import db, WebhookEndpoint
+from models import db, WebhookEndpoint, WebhookDelivery
 from utils.auth import auth_required
 from utils.rate_limit import rate_limit
 from utils.logger import log_request
+from utils.webhook_delivery import enqueue_deliveries, add_deliveries
+from utils.webhook_routing import event_router, parse_events, set_subscriptions, backfill_subscriptions
+from utils.webhook_health import get_health, reset_health
+from utils.idempotency import get_idempotency_key, claim_idempotency_key, release_idempotency_key
+from utils.ndjson import read_ndjson
 
 logger = logging.getLogger(__name__)
 webhook_bp = Blueprint('webhook', __name__, url_prefix='/api/webhooks')
 
+def apply_batching(webhook, data):
+    """Validate and apply the batched delivery settings in a request body"""
+    config = current_app.config
+    
+    if 'batch_max_size' in data:
+        size = data['batch_max_size']
+        if size is not None and (isinstance(size, bool) or not isinstance(size, int) or
+                                 not 1 <= size <= config.get('WEBHOOK_BATCH_MAX_SIZE', 1000)):
+            raise BadRequest(f"batch_max_size must be null or between 1 and {config.get('WEBHOOK_BATCH_MAX_SIZE', 1000)}")
+        webhook.batch_max_size = size
+    
+    if 'batch_linger' in data:
+        linger = data['batch_linger']
+        if isinstance(linger, bool) or not isinstance(linger, (int, float)) or \
+                not 0 <= linger <= config.get('WEBHOOK_BATCH_MAX_LINGER', 300):
+            raise BadRequest(f"batch_linger must be between 0 and {config.get('WEBHOOK_BATCH_MAX_LINGER', 300)} seconds")
+        webhook.batch_linger = float(linger)
+
+def serialize_batching(webhook):
+    """Describe an endpoint's batched delivery settings, or None if it is off"""
+    if not webhook.batch_max_size:
+        return None
+    
+    return {
+        'max_size': webhook.batch_max_size,
+        'linger': webhook.batch_linger
+    }
+
+def find_webhooks(event_type):
+    """Get the active webhook endpoints subscribed to an event"""
+    webhook_ids = event_router.resolve(event_type)
+    if not webhook_ids:
+        return []
+    
+    return WebhookEndpoint.query.filter(
+        WebhookEndpoint.id.in_(webhook_ids),
+        WebhookEndpoint.is_active == True
+    ).order_by(WebhookEndpoint.id).all()
+
+def serialize_delivery(delivery):
+    """Describe a queued webhook delivery"""
+    return {
+        'id': delivery.id,
+        'webhook_id': delivery.webhook_id,
+        'event': delivery.event,
+        'status': delivery.status,
+        'attempts': delivery.attempts,
+        'next_attempt_at': delivery.next_attempt_at.isoformat() if delivery.status == WebhookDelivery.STATUS_PENDING else None,
+        'last_status_code': delivery.last_status_code,
+        'last_error': delivery.last_error,
+        'created_at': delivery.created_at.isoformat(),
+        'delivered_at': delivery.delivered_at.isoformat() if delivery.delivered_at else None
+    }
+
 @webhook_bp.route('/', methods=['GET'])
 @auth_required
 @rate_limit
@@ -51,14 +108,21 @@ def create_webhook():
         if field not in data:
             raise BadRequest(f'Missing required field: {field}')
     
+    try:
+        events = parse_events(data['events'])
+    except ValueError as e:
+        raise BadRequest(str(e))
+    
     # Create webhook endpoint
     webhook = WebhookEndpoint(
         name=data['name'],
         url=data['url'],
         user_id=g.user.id,
-        events=','.join(data['events']),
-        secret=data.get('secret')
+        secret=data.get('secret'),
+        batch_linger=5.0
     )
+    set_subscriptions(webhook, events)
+    apply_batching(webhook, data)
     
     db.session.add(webhook)
     db.session.commit()
@@ -71,6 +135,7 @@ def create_webhook():
             'name': webhook.name,
             'url': webhook.url,
             'events': webhook.events.split(','),
+            'batching': serialize_batching(webhook),
             'created_at': webhook.created_at.isoformat()
         }
     }), 201
@@ -97,8 +162,10 @@ def get_webhook(webhook_id):
             'name': webhook.name,
             'url': webhook.url,
             'events': webhook.events.split(','),
+            'batching': serialize_batching(webhook),
             'created_at': webhook.created_at.isoformat(),
-            'is_active': webhook.is_active
+            'is_active': webhook.is_active,
+            'health': get_health(webhook)
         }
     })
 
@@ -128,11 +195,18 @@ def update_webhook(webhook_id):
     if 'url' in data:
         webhook.url = data['url']
     if 'events' in data:
-        webhook.events = ','.join(data['events'])
+        try:
+            set_subscriptions(webhook, parse_events(data['events']))
+        except ValueError as e:
+            raise BadRequest(str(e))
     if 'secret' in data:
         webhook.secret = data['secret']
     if 'is_active' in data:
+        # Re-enabling an endpoint gives it a fresh start with a closed circuit
+        if data['is_active'] and not webhook.is_active:
+            reset_health(webhook)
         webhook.is_active = data['is_active']
+    apply_batching(webhook, data)
     
     db.session.commit()
     
@@ -144,6 +218,7 @@ def update_webhook(webhook_id):
             'name': webhook.name,
             'url': webhook.url,
             'events': webhook.events.split(','),
+            'batching': serialize_batching(webhook),
             'is_active': webhook.is_active
         }
     })
@@ -163,6 +238,7 @@ def delete_webhook(webhook_id):
             'message': 'Webhook endpoint not found'
         }), 404
     
+    WebhookDelivery.query.filter_by(webhook_id=webhook.id).delete()
     db.session.delete(webhook)
     db.session.commit()
     
@@ -182,11 +258,20 @@ def receive_webhook(event_type):
     if not data:
         raise BadRequest('Invalid JSON payload')
     
+    # Upstream retries of an event we already accepted are acknowledged, not sent again
+    scope = f"webhook:{event_type}"
+    idempotency_key = get_idempotency_key(data, current_app.config.get('WEBHOOK_IDEMPOTENCY_FIELD'))
+    if not claim_idempotency_key(scope, idempotency_key):
+        return jsonify({
+            'status': 'success',
+            'message': 'Duplicate webhook ignored',
+            'event': event_type,
+            'duplicate': True
+        })
+    
     # Find all active webhook endpoints for this event
-    webhooks = WebhookEndpoint.query.filter(
-        WebhookEndpoint.is_active == True,
-        WebhookEndpoint.events.like(f'%{event_type}%')
-    ).all()
+    event_router.refresh(current_app.config.get('WEBHOOK_ROUTES_REFRESH', 30))
+    webhooks = find_webhooks(event_type)
     
     if not webhooks:
         return jsonify({
@@ -195,59 +280,182 @@ def receive_webhook(event_type):
             'event': event_type
         })
     
-    # Dispatch webhook to all registered endpoints
-    results = []
-    for webhook in webhooks:
-        try:
-            # Prepare payload with event type
-            payload = {
-                'event': event_type,
-                'data': data,
-                'timestamp': request.headers.get('X-Request-Timestamp', '')
-            }
+    # Prepare payload with event type
+    payload = {
+        'event': event_type,
+        'data': data,
+        'timestamp': request.headers.get('X-Request-Timestamp', '')
+    }
+    
+    # Store a delivery per endpoint; the delivery worker sends and retries them
+    try:
+        deliveries = enqueue_deliveries(webhooks, event_type, payload)
+    except Exception:
+        release_idempotency_key(scope, idempotency_key)
+        raise
+    
+    return jsonify({
+        'status': 'success',
+        'message': 'Webhook received and queued for delivery',
+        'event': event_type,
+        'deliveries': [{
+            'id': delivery.id,
+            'webhook_id': delivery.webhook_id,
+            'status': delivery.status
+        } for delivery in deliveries]
+    }), 202
+
+
+@webhook_bp.route('/receive', methods=['POST'])
+@rate_limit
+@log_request
+def receive_webhooks_bulk():
+    """
+    Receive many events as newline-delimited JSON and queue them for delivery
+    
+    Each line is an object with an "event" type, optional "data" and optional
+    "timestamp". The body is read line by line and committed in chunks, so
+    its size is not bounded by memory. Bad lines are reported and skipped,
+    and lines whose idempotency field was already seen are counted as
+    duplicates.
+    """
+    config = current_app.config
+    idempotency_field = config.get('WEBHOOK_IDEMPOTENCY_FIELD')
+    max_events = config.get('WEBHOOK_BULK_MAX_EVENTS', 10000)
+    max_errors = config.get('WEBHOOK_BULK_MAX_ERRORS', 100)
+    chunk_size = config.get('WEBHOOK_BULK_CHUNK_SIZE', 500)
+    timestamp = request.headers.get('X-Request-Timestamp', '')
+    now = datetime.datetime.utcnow()
+    
+    event_router.refresh(config.get('WEBHOOK_ROUTES_REFRESH', 30))
+    
+    routes = {}  # Matching endpoints per event type, looked up once per request
+    summary = {'events': 0, 'queued': 0, 'unrouted': 0, 'rejected': 0, 'duplicates': 0, 'deliveries': 0}
+    errors = []
+    uncommitted = 0
+    claimed = []  # Idempotency keys of events not committed yet
+    
+    def reject(line_number, message):
+        summary['rejected'] += 1
+        if len(errors) < max_errors:
+            errors.append({'line': line_number, 'message': message})
+    
+    try:
+        for line_number, item, error in read_ndjson(request.stream, config.get('WEBHOOK_BULK_MAX_LINE', 262144)):
+            if summary['events'] >= max_events:
+                reject(line_number, f'More than {max_events} events; the rest of the body was ignored')
+                break
+            summary['events'] += 1
+            
+            if error:
+                reject(line_number, error)
+                continue
+            
+            event_type = item.get('event') if isinstance(item, dict) else None
+            if not isinstance(event_type, str) or not event_type or len(event_type) > 128:
+                reject(line_number, 'Each line needs an "event" type')
+                continue
             
-            headers = {'Content-Type': 'application/json'}
+            idempotency_key = get_idempotency_key(item, idempotency_field, from_headers=False)
+            if not claim_idempotency_key(f"webhook:{event_type}", idempotency_key):
+                summary['duplicates'] += 1
+                continue
+            if idempotency_key is not None:
+                claimed.append((f"webhook:{event_type}", idempotency_key))
             
-            # Add signature if secret is set
-            if webhook.secret:
-                payload_bytes = json.dumps(payload).encode('utf-8')
-                signature = hmac.new(
-                    webhook.secret.encode('utf-8'),
-                    payload_bytes,
-                    hashlib.sha256
-                ).hexdigest()
-                headers['X-Webhook-Signature'] = signature
+            webhooks = routes.get(event_type)
+            if webhooks is None:
+                webhooks = routes[event_type] = find_webhooks(event_type)
             
-            # Send webhook
-            response = requests.post(
-                webhook.url,
-                json=payload,
-                headers=headers,
-                timeout=current_app.config.get('WEBHOOK_TIMEOUT', 5)
-            )
+            if not webhooks:
+                summary['unrouted'] += 1
+                continue
             
-            results.append({
-                'webhook_id': webhook.id,
-                'status': 'success' if response.status_code < 400 else 'error',
-                'status_code': response.status_code
-            })
+            payload = {
+                'event': event_type,
+                'data': item.get('data', {}),
+                'timestamp': item.get('timestamp', timestamp)
+            }
+            add_deliveries(webhooks, event_type, payload, now)
+            summary['queued'] += 1
+            summary['deliveries'] += len(webhooks)
             
-        except requests.RequestException as e:
-            logger.error(f"Error dispatching webhook to {webhook.url}: {str(e)}")
-            results.append({
-                'webhook_id': webhook.id,
-                'status': 'error',
-                'error': str(e)
-            })
+            uncommitted += 1
+            if uncommitted >= chunk_size:
+                db.session.commit()
+                claimed.clear()
+                uncommitted = 0
+        
+        if uncommitted:
+            db.session.commit()
+    except Exception:
+        # Let the upstream retry the events that were not stored
+        db.session.rollback()
+        for scope, idempotency_key in claimed:
+            release_idempotency_key(scope, idempotency_key)
+        raise
     
     return jsonify({
         'status': 'success',
-        'message': 'Webhook received and dispatched',
-        'event': event_type,
-        'results': results
+        'message': 'Events received and queued for delivery',
+        'data': dict(summary, errors=errors)
+    }), 202
+
+
+@webhook_bp.route('/<int:webhook_id>/deliveries', methods=['GET'])
+@auth_required
+@rate_limit
+@log_request
+def get_webhook_deliveries(webhook_id):
+    """Get recent deliveries for a specific webhook endpoint"""
+    webhook = WebhookEndpoint.query.filter_by(id=webhook_id, user_id=g.user.id).first()
+    
+    if not webhook:
+        return jsonify({
+            'status': 'error',
+            'message': 'Webhook endpoint not found'
+        }), 404
+    
+    query = WebhookDelivery.query.filter_by(webhook_id=webhook.id)
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    deliveries = query.order_by(WebhookDelivery.id.desc()).limit(limit).all()
+    
+    return jsonify({
+        'status': 'success',
+        'data': [serialize_delivery(delivery) for delivery in deliveries]
+    })
+
+
+@webhook_bp.route('/deliveries/<int:delivery_id>', methods=['GET'])
+@auth_required
+@rate_limit
+@log_request
+def get_delivery(delivery_id):
+    """Get the status of a specific webhook delivery"""
+    delivery = WebhookDelivery.query.filter_by(id=delivery_id, user_id=g.user.id).first()
+    
+    if not delivery:
+        return jsonify({
+            'status': 'error',
+            'message': 'Webhook delivery not found'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'data': serialize_delivery(delivery)
     })
 
 
+@webhook_bp.cli.command('backfill-subscriptions')
+def backfill_subscriptions_command():
+    """Create subscription rows for webhooks saved before subscriptions existed"""
+    count = backfill_subscriptions()
+    click.echo(f"Backfilled subscriptions for {count} webhook endpoints")
+
+
 def register_webhook_routes(app):
     """Register webhook routes with the app"""
     app.register_blueprint(webhook_bp)
@@ -0,0 +1,88 @@
+import time
+import logging
+from flask import request, jsonify, current_app, make_response
+from utils.rate_limit import get_rate_limit_store
+from utils.rate_limit_policy import parse_default
+
+logger = logging.getLogger(__name__)
+
+# Counters for requests turned away before route dispatch
+admission_stats = {
+    'admitted': 0,
+    'rejected_global': 0,
+    'rejected_ip': 0,
+    'rejected_auth_failures': 0,
+    'auth_failures': 0
+}
+
+def has_credentials():
+    """Check whether the request carries an API key or access token"""
+    return bool(request.headers.get('Authorization') or request.args.get('api_key'))
+
+def reject(reason, retry_after):
+    """Build a 429 response for a request refused at admission"""
+    admission_stats[f'rejected_{reason}'] += 1
+    logger.warning(f"Admission rejected ({reason}) for {request.remote_addr}")
+    
+    response = make_response(jsonify({
+        'status': 'error',
+        'message': 'Rate limit exceeded. Please try again later.'
+    }), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def admit_request():
+    """
+    Apply global and per-IP limits before routing, authentication or any DB access
+    
+    The per-IP budget applies to requests without credentials; the client
+    address comes from X-Forwarded-For as set by the proxy ProxyFix trusts.
+    """
+    config = current_app.config
+    
+    if not config.get('ADMISSION_ENABLED', True) or not request.path.startswith('/api/'):
+        return None
+    
+    store = get_rate_limit_store()
+    now = time.time()
+    
+    rate = parse_default(config.get('ADMISSION_GLOBAL_LIMIT'))
+    allowed, _, retry_after, _ = store.hit('admission:global', rate.limit, rate.window, now)
+    if not allowed:
+        return reject('global', retry_after)
+    
+    ip = request.remote_addr
+    if has_credentials():
+        # Callers with credentials are limited per key once authenticated;
+        # addresses that keep presenting bad credentials are refused before the
+        # API key lookup. A zero-cost hit only checks the failure budget.
+        rate = parse_default(config.get('ADMISSION_AUTH_FAILURE_LIMIT'))
+        allowed, _, retry_after, _ = store.hit(f"admission:authfail:{ip}", rate.limit, rate.window, now, 0)
+        if not allowed:
+            return reject('auth_failures', retry_after)
+    else:
+        rate = parse_default(config.get('ADMISSION_IP_LIMIT'))
+        allowed, _, retry_after, _ = store.hit(f"admission:ip:{ip}", rate.limit, rate.window, now)
+        if not allowed:
+            return reject('ip', retry_after)
+    
+    admission_stats['admitted'] += 1
+    return None
+
+def record_auth_failure():
+    """Charge a failed authentication attempt to the caller's address"""
+    admission_stats['auth_failures'] += 1
+    
+    rate = parse_default(current_app.config.get('ADMISSION_AUTH_FAILURE_LIMIT'))
+    # Let the counter reach limit + 1 so the zero-cost check in admit_request trips
+    get_rate_limit_store().hit(
+        f"admission:authfail:{request.remote_addr}", rate.limit + 1, rate.window, time.time()
+    )
+
+def get_admission_stats():
+    """Get admission counters for this worker"""
+    return dict(admission_stats)
+
+def register_admission_control(app):
+    """Register the admission limiter to run before every request"""
+    app.before_request(admit_request)
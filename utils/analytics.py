@@ -0,0 +1,194 @@
+import json
+import bisect
+import logging
+import datetime
+import threading
+from models import db, RequestRollup
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+def minute_bucket(timestamp):
+    """Truncate a datetime to the start of its minute"""
+    return timestamp.replace(second=0, microsecond=0)
+
+def status_class(status_code):
+    """Map a status code to its class, e.g. 404 -> 4xx"""
+    return f"{int(status_code) // 100}xx"
+
+def percentile(histogram, latency_max, q):
+    """
+    Estimate a latency percentile from histogram counts
+    
+    Interpolates linearly inside the bucket holding the q-th observation; the
+    open-ended last bucket is bounded by the observed maximum.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+            upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else max(latency_max, lower)
+            upper = min(upper, latency_max) if latency_max else upper
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    
+    return latency_max
+
+
+class RollupAggregator:
+    """
+    Accumulates request logs into per-minute rollups in memory
+    
+    Minutes are written to the database once they are over, so each worker
+    writes roughly one row per endpoint, status class and user per minute.
+    """
+    
+    def __init__(self):
+        self._rollups = {}
+        self._lock = threading.Lock()
+        self.rows_written = 0
+    
+    def add(self, record, route=None):
+        """Fold one request log record into its minute"""
+        key = (
+            minute_bucket(record['timestamp']),
+            record['method'],
+            (route or record['endpoint'])[:256],
+            status_class(record['status_code']),
+            record['user_id']
+        )
+        latency = record['response_time']
+        
+        with self._lock:
+            rollup = self._rollups.get(key)
+            if rollup is None:
+                rollup = self._rollups[key] = {
+                    'count': 0,
+                    'error_count': 0,
+                    'latency_sum': 0.0,
+                    'latency_max': 0.0,
+                    'histogram': [0] * (len(LATENCY_BUCKETS) + 1)
+                }
+            
+            rollup['count'] += 1
+            rollup['error_count'] += int(record['status_code']) >= 400
+            rollup['latency_sum'] += latency
+            rollup['latency_max'] = max(rollup['latency_max'], latency)
+            rollup['histogram'][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+    
+    @staticmethod
+    def _to_row(key, rollup):
+        bucket, method, endpoint, klass, user_id = key
+        return RequestRollup(
+            bucket=bucket,
+            method=method,
+            endpoint=endpoint,
+            status_class=klass,
+            user_id=user_id,
+            count=rollup['count'],
+            error_count=rollup['error_count'],
+            latency_sum=rollup['latency_sum'],
+            latency_max=rollup['latency_max'],
+            histogram=json.dumps(rollup['histogram'])
+        )
+    
+    def pending_rows(self, user_id, since):
+        """
+        Get a user's rollups that have not been written yet, including the current minute
+        
+        Returns:
+            list: Unsaved RequestRollup rows, to be merged with the stored ones
+        """
+        with self._lock:
+            rollups = [(key, dict(rollup, histogram=list(rollup['histogram'])))
+                       for key, rollup in self._rollups.items() if key[4] == user_id and key[0] >= since]
+        
+        return [self._to_row(key, rollup) for key, rollup in rollups]
+    
+    def flush(self, force=False):
+        """Write finished minutes (or everything, if force) as rollup rows"""
+        current = minute_bucket(datetime.datetime.utcnow())
+        
+        with self._lock:
+            ready = [key for key in self._rollups if force or key[0] < current]
+            rollups = [(key, self._rollups.pop(key)) for key in ready]
+        
+        if not rollups:
+            return 0
+        
+        try:
+            db.session.add_all([self._to_row(key, rollup) for key, rollup in rollups])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to write {len(rollups)} request rollups: {str(e)}")
+            return 0
+        
+        self.rows_written += len(rollups)
+        return len(rollups)
+    
+    def stats(self):
+        """Return pending and written rollup counts"""
+        return {
+            'pending': len(self._rollups),
+            'rows_written': self.rows_written
+        }
+
+
+rollup_aggregator = RollupAggregator()
+
+def summarize_rollups(rollups):
+    """
+    Merge rollup rows into per-endpoint summaries
+    
+    Returns:
+        list: One dict per (method, endpoint) with counts and latency percentiles
+    """
+    merged = {}
+    
+    for row in rollups:
+        key = (row.method, row.endpoint)
+        summary = merged.get(key)
+        if summary is None:
+            summary = merged[key] = {
+                'count': 0,
+                'error_count': 0,
+                'latency_sum': 0.0,
+                'latency_max': 0.0,
+                'histogram': [0] * (len(LATENCY_BUCKETS) + 1),
+                'status_classes': {}
+            }
+        
+        summary['count'] += row.count
+        summary['error_count'] += row.error_count
+        summary['latency_sum'] += row.latency_sum
+        summary['latency_max'] = max(summary['latency_max'], row.latency_max)
+        for index, count in enumerate(json.loads(row.histogram)):
+            summary['histogram'][index] += count
+        summary['status_classes'][row.status_class] = summary['status_classes'].get(row.status_class, 0) + row.count
+    
+    return [{
+        'method': method,
+        'endpoint': endpoint,
+        'count': summary['count'],
+        'error_count': summary['error_count'],
+        'error_rate': round(summary['error_count'] / summary['count'], 4),
+        'status_classes': summary['status_classes'],
+        'latency': {
+            'avg': round(summary['latency_sum'] / summary['count'], 6),
+            'p50': _round(percentile(summary['histogram'], summary['latency_max'], 0.50)),
+            'p95': _round(percentile(summary['histogram'], summary['latency_max'], 0.95)),
+            'p99': _round(percentile(summary['histogram'], summary['latency_max'], 0.99)),
+            'max': round(summary['latency_max'], 6)
+        }
+    } for (method, endpoint), summary in sorted(merged.items(), key=lambda item: item[0][::-1])]
+
+def _round(value):
+    return round(value, 6) if value is not None else None
@@ -1,12 +1,61 @@
 import logging
+from collections import namedtuple
 from functools import wraps
-from flask import request, jsonify, g
+from flask import request, jsonify, g, current_app
+from sqlalchemy import event
 from models import User, ApiKey
+from utils.cache import TTLCache
+from utils.usage_buffer import last_used_buffer
+from utils.tokens import is_access_token, verify_access_token, revoke_user_tokens
+from utils.admission import record_auth_failure
 
 logger = logging.getLogger(__name__)
 
+# Resolved identity of an authenticated caller. `id` is the user id so that
+# handlers can keep using `g.user.id` without touching the database.
+Principal = namedtuple('Principal', ['id', 'api_key_id'])
+
+# Cache of API key -> Principal, created lazily from the app configuration
+principal_cache = None
+
+def get_principal_cache():
+    """Get the principal cache, creating it from the app configuration"""
+    global principal_cache
+    
+    if principal_cache is None:
+        principal_cache = TTLCache(
+            maxsize=current_app.config.get('AUTH_CACHE_SIZE', 10000),
+            ttl=current_app.config.get('AUTH_CACHE_TTL', 60)
+        )
+    
+    return principal_cache
+
+def invalidate_api_key(api_key):
+    """Drop a cached principal for an API key string"""
+    if principal_cache is not None:
+        principal_cache.pop(api_key)
+
+def invalidate_user(user_id):
+    """Drop all cached principals belonging to a user"""
+    if principal_cache is not None:
+        principal_cache.discard_where(lambda principal: principal.id == user_id)
+
+def get_auth_cache_stats():
+    """Get hit/miss counters for the principal cache"""
+    if principal_cache is None:
+        return {'size': 0, 'hits': 0, 'misses': 0}
+    
+    return principal_cache.stats()
+
+@event.listens_for(User.is_active, 'set')
+def _on_user_active_changed(target, value, oldvalue, initiator):
+    """Invalidate cached principals and tokens when a user is deactivated"""
+    if not value and target.id is not None:
+        invalidate_user(target.id)
+        revoke_user_tokens(target.id)
+
 def get_api_key_from_request():
-    """Extract API key from the request"""
+    """Extract API key or signed access token from the request"""
     # Try to get from header
     auth_header = request.headers.get('Authorization')
     if auth_header and auth_header.startswith('Bearer '):
@@ -19,11 +68,8 @@ def get_api_key_from_request():
     
     return None
 
-def validate_api_key(api_key):
-    """Validate the API key and return the associated user if valid"""
-    if not api_key:
-        return None
-    
+def load_principal(api_key):
+    """Look up an active API key and its active user in the database"""
     # Find the API key in the database
     api_key_obj = ApiKey.query.filter_by(key=api_key, is_active=True).first()
     
@@ -36,19 +82,56 @@ def validate_api_key(api_key):
     if not user:
         return None
     
-    # Update last used timestamp
-    api_key_obj.update_last_used()
+    return Principal(id=user.id, api_key_id=api_key_obj.id)
+
+def validate_api_key(api_key):
+    """Validate the API key and return the associated principal if valid"""
+    if not api_key:
+        return None
+    
+    cache = get_principal_cache()
+    principal = cache.get(api_key)
+    
+    if principal is None:
+        principal = load_principal(api_key)
+        
+        if not principal:
+            return None
+        
+        cache.set(api_key, principal)
     
-    return user
+    # Record usage; the timestamp is written back in bulk by a background flusher
+    last_used_buffer.record(principal.api_key_id)
+    
+    return principal
+
+def validate_access_token(token):
+    """Validate a signed access token and return its principal if valid"""
+    claims = verify_access_token(token)
+    
+    if not claims:
+        return None
+    
+    last_used_buffer.record(claims['kid'])
+    
+    return Principal(id=claims['uid'], api_key_id=claims['kid'])
 
 def auth_required(f):
     """Decorator to require API key authentication for a route"""
     @wraps(f)
     def decorated(*args, **kwargs):
         api_key = get_api_key_from_request()
-        user = validate_api_key(api_key)
+        
+        # Signed access tokens are verified without any database lookup
+        if is_access_token(api_key):
+            user = validate_access_token(api_key)
+            g.auth_type = 'token'
+        else:
+            user = validate_api_key(api_key)
+            g.auth_type = 'api_key'
         
         if not user:
+            record_auth_failure()
             return jsonify({
                 'status': 'error',
                 'message': 'Invalid or missing API key'
@@ -0,0 +1,47 @@
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PeriodicWorker(threading.Thread):
+    """Daemon thread that runs a task inside the app context every interval seconds"""
+    
+    def __init__(self, app, name, interval, task, run_on_stop=True):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.task = task
+        self.run_on_stop = run_on_stop
+        self._stop_event = threading.Event()
+    
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.run_task()
+    
+    def run_task(self):
+        """Run the task once, logging instead of raising on failure"""
+        with self.app.app_context():
+            try:
+                self.task()
+            except Exception as e:
+                logger.error(f"Background task {self.name} failed: {str(e)}")
+    
+    def stop(self, timeout=None):
+        """Stop the loop and, if run_on_stop, run the task one last time"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        if self.run_on_stop:
+            self.run_task()
+
+
+def start_periodic_worker(app, name, interval, task, run_on_stop=True):
+    """Start a periodic worker and stop it cleanly at shutdown"""
+    worker = PeriodicWorker(app, name, interval, task, run_on_stop)
+    worker.start()
+    atexit.register(worker.stop, timeout=interval)
+    
+    logger.info(f"Started background worker {name} (every {interval}s)")
+    
+    return worker
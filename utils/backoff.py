@@ -0,0 +1,6 @@
+import random
+
+def compute_backoff(attempts, base_delay, max_delay):
+    """Exponential backoff with equal jitter for the given attempt number"""
+    delay = min(max_delay, base_delay * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
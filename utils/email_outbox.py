@@ -0,0 +1,270 @@
+import os
+import json
+import uuid
+import random
+import socket
+import logging
+import datetime
+from flask import current_app
+from sqlalchemy import or_, update
+from models import db, EmailMessage
+from utils.background import start_periodic_worker
+from utils.backoff import compute_backoff
+from utils.email_service import send_email
+from utils.smtp_rate import get_relay_limiter
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process when claiming messages
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def as_list(addresses):
+    """Normalize an address or list of addresses to a list"""
+    if not addresses:
+        return []
+    
+    return list(addresses) if isinstance(addresses, list) else [addresses]
+
+def add_email(user_id, to, subject, body, html=None, cc=None, bcc=None, reply_to=None, template_id=None):
+    """
+    Add a queued message to the session; nothing is committed
+    
+    Returns:
+        EmailMessage: The new message
+    """
+    message = EmailMessage(
+        user_id=user_id,
+        template_id=template_id,
+        recipients=json.dumps({'to': as_list(to), 'cc': as_list(cc), 'bcc': as_list(bcc)}),
+        reply_to=reply_to,
+        subject=subject,
+        body=body,
+        html=html
+    )
+    
+    db.session.add(message)
+    return message
+
+def queue_email(user_id, to, subject, body, html=None, cc=None, bcc=None, reply_to=None, template_id=None):
+    """
+    Store a message for the background senders
+    
+    Returns:
+        EmailMessage: The queued message
+    """
+    message = add_email(user_id, to, subject, body, html, cc, bcc, reply_to, template_id)
+    db.session.commit()
+    
+    return message
+
+def claim_due_messages(limit, lease_seconds):
+    """
+    Claim queued messages that are due, oldest first, so no other sender sends them
+    
+    Returns:
+        list: Claimed EmailMessage rows
+    """
+    now = datetime.datetime.utcnow()
+    claimable = or_(EmailMessage.locked_until.is_(None), EmailMessage.locked_until < now)
+    
+    ids = [
+        message_id for message_id, in db.session.query(EmailMessage.id).filter(
+            EmailMessage.status == EmailMessage.STATUS_QUEUED,
+            EmailMessage.next_attempt_at <= now,
+            claimable
+        ).order_by(EmailMessage.next_attempt_at, EmailMessage.id).limit(limit)
+    ]
+    if not ids:
+        return []
+    
+    # The conditional UPDATE is the claim; rows another sender got first are skipped
+    token = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    db.session.execute(
+        update(EmailMessage)
+        .where(EmailMessage.id.in_(ids), EmailMessage.status == EmailMessage.STATUS_QUEUED, claimable)
+        .values(claimed_by=token, locked_until=now + datetime.timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    
+    return EmailMessage.query.filter_by(claimed_by=token).order_by(EmailMessage.id).all()
+
+def record_reply(message, result):
+    """Keep the relay's reply to the last attempt on the message"""
+    smtp_code = result.get('smtp_code')
+    refused = result.get('refused') or {}
+    
+    message.last_smtp_code = smtp_code if smtp_code is not None else min(refused.values(), default=None)
+    message.last_error = (result.get('error') or '')[:256] or None
+    if refused and not message.last_error:
+        message.last_error = f"Recipients refused: {', '.join(sorted(refused))}"[:256]
+
+def record_refusals(message, result):
+    """
+    Handle recipients the relay refused one by one
+    
+    A temporary (4xx) refusal is retried for that recipient alone, so
+    recipients that already got the message don't get it again; a permanent
+    one is given up on. Recipients the relay accepted are kept as delivered.
+    
+    Returns:
+        tuple: (recipients still to be sent to, recipients delivered so far)
+    """
+    refused = result['refused']
+    retry = [address for address, code in refused.items() if code < 500]
+    
+    recipients = json.loads(message.recipients)
+    delivered = recipients.get('delivered', [])
+    if result['status'] == 'success':
+        attempted = recipients.get('pending') or recipients['to'] + recipients['cc'] + recipients['bcc']
+        delivered = delivered + [address for address in attempted if address not in refused]
+    
+    recipients['refused'] = dict(recipients.get('refused', {}), **{
+        address: code for address, code in refused.items() if code >= 500
+    })
+    recipients['pending'] = retry
+    recipients['delivered'] = delivered
+    message.recipients = json.dumps(recipients)
+    
+    return retry, delivered
+
+def record_result(message, result, config):
+    """Update a message after a send attempt, scheduling a retry or giving up"""
+    now = datetime.datetime.utcnow()
+    smtp_code = result.get('smtp_code')
+    refused = result.get('refused') or {}
+    retry, delivered = record_refusals(message, result) if refused else ([], [])
+    
+    message.attempts += 1
+    message.claimed_by = None
+    message.locked_until = None
+    record_reply(message, result)
+    
+    if result['status'] == 'success' and not retry:
+        message.status = EmailMessage.STATUS_SENT
+        message.sent_at = now
+    elif refused and not retry and delivered:
+        # Earlier attempts got it to the other recipients
+        message.status = EmailMessage.STATUS_SENT
+        message.sent_at = now
+        logger.warning(f"Email message {message.id} sent to {len(delivered)} recipients; the rest refused it")
+    elif refused and not retry:
+        message.status = EmailMessage.STATUS_FAILED
+        logger.warning(f"Email message {message.id} refused for every recipient")
+    elif smtp_code is not None and smtp_code >= 500:
+        # Permanent refusals won't succeed on a retry
+        message.status = EmailMessage.STATUS_FAILED
+        logger.warning(f"Email message {message.id} refused by the relay: {smtp_code}")
+    elif message.attempts >= config.get('MAIL_MAX_ATTEMPTS', 6):
+        message.status = EmailMessage.STATUS_FAILED
+        logger.warning(f"Email message {message.id} failed after {message.attempts} attempts")
+    else:
+        delay = compute_backoff(
+            message.attempts,
+            config.get('MAIL_RETRY_BASE_DELAY', 30),
+            config.get('MAIL_RETRY_MAX_DELAY', 3600)
+        )
+        message.next_attempt_at = now + datetime.timedelta(seconds=delay)
+
+def defer(message, until, result=None):
+    """Put a message back in the queue without using up an attempt"""
+    message.claimed_by = None
+    message.locked_until = None
+    message.next_attempt_at = until
+    if result is not None:
+        record_reply(message, result)
+
+def send_message(message):
+    """Send a stored message over the pooled SMTP connections, to the recipients still waiting for it"""
+    recipients = json.loads(message.recipients)
+    
+    return send_email(
+        recipients['to'], message.subject, message.body, message.html,
+        recipients['cc'], recipients['bcc'], message.reply_to, recipients.get('pending')
+    )
+
+def send_claimed(messages, limiter, config):
+    """
+    Send claimed messages at the pace the relay allows
+    
+    Throttle replies, to the message or to any of its recipients, slow the
+    relay's rate down and put the message back in the queue (for the
+    throttled recipients only) without using an attempt, unless it has
+    already waited MAIL_THROTTLE_MAX_AGE. If the next token is further off than
+    MAIL_RATE_MAX_WAIT, the rest of the claim is put back rather than
+    holding the sender.
+    
+    Returns:
+        tuple: (messages the relay accepted, False if the relay's rate cut the claim short)
+    """
+    throttle_codes = config.get('MAIL_THROTTLE_CODES', (421, 451))
+    max_age = datetime.timedelta(seconds=config.get('MAIL_THROTTLE_MAX_AGE', 86400))
+    retry_delay = config.get('MAIL_THROTTLE_RETRY_DELAY', 15)
+    sent = 0
+    
+    for index, message in enumerate(messages):
+        wait = limiter.acquire(config.get('MAIL_RATE_MAX_WAIT', 5))
+        if wait:
+            until = datetime.datetime.utcnow() + datetime.timedelta(seconds=wait)
+            for waiting in messages[index:]:
+                defer(waiting, until)
+            db.session.commit()
+            return sent, False
+        
+        result = send_message(message)
+        now = datetime.datetime.utcnow()
+        refused = result.get('refused') or {}
+        
+        if result.get('smtp_code') in throttle_codes or any(code in throttle_codes for code in refused.values()):
+            limiter.record_throttle()
+            if now - message.created_at < max_age:
+                if refused:
+                    record_refusals(message, result)
+                delay = retry_delay * random.uniform(1, 1.5)
+                defer(message, now + datetime.timedelta(seconds=delay), result)
+            else:
+                record_result(message, result, config)
+        else:
+            if result['status'] == 'success':
+                limiter.record_success()
+            record_result(message, result, config)
+        
+        if result['status'] == 'success':
+            sent += 1
+        
+        # Commit each outcome so a crash can't send a message twice
+        db.session.commit()
+    
+    return sent, True
+
+def process_outbox():
+    """Claim and send due messages until none are left"""
+    config = current_app.config
+    batch_size = config.get('MAIL_OUTBOX_BATCH_SIZE', 5)
+    # Messages in a claim are sent one after another, each within MAIL_TIMEOUT
+    # per command plus any wait for the relay's rate
+    lease = batch_size * (config.get('MAIL_TIMEOUT', 30) + config.get('MAIL_RATE_MAX_WAIT', 5)) + 30
+    limiter = get_relay_limiter()
+    sent = 0
+    
+    while True:
+        messages = claim_due_messages(batch_size, lease)
+        if not messages:
+            break
+        
+        accepted, finished = send_claimed(messages, limiter, config)
+        sent += accepted
+        
+        if not finished or len(messages) < batch_size:
+            break
+    
+    return sent
+
+def start_outbox_senders(app):
+    """Start the background threads that send queued email"""
+    interval = app.config.get('MAIL_OUTBOX_POLL_INTERVAL', 1)
+    
+    return [
+        start_periodic_worker(app, f"email-outbox-{number}", interval, process_outbox, run_on_stop=False)
+        for number in range(1, max(app.config.get('MAIL_OUTBOX_SENDERS', 4), 1) + 1)
+    ]
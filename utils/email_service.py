@@ -3,10 +3,11 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask import current_app
+from utils.smtp_pool import get_smtp_pool
 
 logger = logging.getLogger(__name__)
 
-def send_email(to, subject, body, html=None, cc=None, bcc=None, reply_to=None):
+def send_email(to, subject, body, html=None, cc=None, bcc=None, reply_to=None, envelope=None):
     """
     Send an email using the configured SMTP server
     
@@ -18,17 +19,17 @@ def send_email(to, subject, body, html=None, cc=None, bcc=None, reply_to=None):
         cc: CC recipients (optional)
         bcc: BCC recipients (optional)
         reply_to: Reply-To email address (optional)
+        envelope: Addresses to deliver to, if not all of to, cc and bcc
+            (optional; the headers still name every recipient)
         
     Returns:
-        dict: Status of the operation
+        dict: Status of the operation, with the relay's reply code if it refused
+        the message and the reply code for each recipient it refused
     """
     try:
         # Get email configuration
         smtp_server = current_app.config.get('MAIL_SERVER')
         smtp_port = current_app.config.get('MAIL_PORT')
-        use_tls = current_app.config.get('MAIL_USE_TLS')
-        username = current_app.config.get('MAIL_USERNAME')
-        password = current_app.config.get('MAIL_PASSWORD')
         sender = current_app.config.get('MAIL_DEFAULT_SENDER')
         
         # Validate configuration
@@ -45,7 +46,7 @@ def send_email(to, subject, body, html=None, cc=None, bcc=None, reply_to=None):
         msg['From'] = sender
         
         # Convert to list if to is a string
-        to_list = to if isinstance(to, list) else [to]
+        to_list = list(to) if isinstance(to, list) else [to]
         msg['To'] = ', '.join(to_list)
         
         # Add CC if provided
@@ -70,26 +71,37 @@ def send_email(to, subject, body, html=None, cc=None, bcc=None, reply_to=None):
         if html:
             msg.attach(MIMEText(html, 'html'))
         
-        # Connect to SMTP server
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        
-        if use_tls:
-            server.starttls()
-        
-        # Login if credentials are provided
-        if username and password:
-            server.login(username, password)
-        
-        # Send email
-        server.sendmail(sender, to_list, msg.as_string())
-        server.quit()
+        # Send over a pooled connection, already secured and logged in
+        refused = get_smtp_pool().send(sender, envelope or to_list, msg.as_string())
         
         logger.info(f"Email sent to {to}")
         
-        return {
+        result = {
             'status': 'success'
         }
+        if refused:
+            logger.warning(f"Email recipients refused: {refused}")
+            result['refused'] = {address: code for address, (code, _) in refused.items()}
         
+        return result
+        
+    except smtplib.SMTPResponseException as e:
+        logger.error(f"Failed to send email: {str(e)}")
+        return {
+            'status': 'error',
+            'error': str(e),
+            'smtp_code': e.smtp_code
+        }
+    
+    except smtplib.SMTPRecipientsRefused as e:
+        logger.error(f"Failed to send email: {str(e)}")
+        # Every recipient was refused, each with its own reply
+        return {
+            'status': 'error',
+            'error': str(e),
+            'refused': {address: code for address, (code, _) in e.recipients.items()}
+        }
+    
     except Exception as e:
         logger.error(f"Failed to send email: {str(e)}")
         return {
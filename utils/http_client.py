@@ -0,0 +1,116 @@
+import os
+import logging
+import threading
+import requests
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter that keeps per-host connection pools and counts their reuse
+    
+    urllib3 keeps up to pool_connections host pools, evicting the least
+    recently used one. Counters from evicted pools are folded into the totals
+    so reuse stats survive eviction.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.Lock()
+        self.retired = {'pools': 0, 'connections': 0, 'requests': 0}
+        super().__init__(*args, **kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self._retire_pool
+    
+    def _retire_pool(self, pool):
+        """Keep an evicted pool's counters, then close it"""
+        with self._lock:
+            self.retired['pools'] += 1
+            self.retired['connections'] += pool.num_connections
+            self.retired['requests'] += pool.num_requests
+        pool.close()
+    
+    def stats(self):
+        """Return connection reuse counters, in total and per host"""
+        pools = self.poolmanager.pools
+        hosts = {}
+        
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts[f"{key.key_scheme}://{key.key_host}:{key.key_port or ''}".rstrip(':')] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'reused': max(pool.num_requests - pool.num_connections, 0),
+                'idle': sum(conn is not None for conn in list(pool.pool.queue)) if pool.pool else 0
+            }
+        
+        with self._lock:
+            connections = self.retired['connections'] + sum(host['connections'] for host in hosts.values())
+            requests_made = self.retired['requests'] + sum(host['requests'] for host in hosts.values())
+            evicted = self.retired['pools']
+        
+        return {
+            'connections': connections,
+            'requests': requests_made,
+            'reused': max(requests_made - connections, 0),
+            'reuse_rate': round(1 - connections / requests_made, 4) if requests_made else 0.0,
+            'evicted_pools': evicted,
+            'hosts': hosts
+        }
+
+
+# Session shared by all outbound calls in this process, created on first use
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def create_session(config):
+    """Build a keep-alive session with pooled connections for every host"""
+    adapter = PooledHTTPAdapter(
+        pool_connections=config.get('HTTP_POOL_CONNECTIONS', 20),
+        pool_maxsize=config.get('HTTP_POOL_MAXSIZE', 16),
+        pool_block=config.get('HTTP_POOL_BLOCK', False),
+        max_retries=0
+    )
+    
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # Never carry cookies from one subscriber or bot response into another request
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    
+    return session
+
+def get_http_session():
+    """Get the shared outbound HTTP session for this process"""
+    global _session, _session_pid
+    
+    # Sockets must not be shared with a forked parent, so each worker builds its own
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = create_session(current_app.config)
+                _session_pid = os.getpid()
+    
+    return _session
+
+def get_timeout(read_timeout=None):
+    """Get the (connect, read) timeout for an outbound call"""
+    config = current_app.config
+    connect_timeout = config.get('HTTP_CONNECT_TIMEOUT', 3.05)
+    read_timeout = read_timeout or config.get('HTTP_READ_TIMEOUT', 10)
+    
+    return (min(connect_timeout, read_timeout), read_timeout)
+
+def get_http_client_stats():
+    """Get connection pool reuse stats for the shared session"""
+    if _session is None or _session_pid != os.getpid():
+        return {'connections': 0, 'requests': 0, 'reused': 0}
+    
+    return _session.get_adapter('https://').stats()
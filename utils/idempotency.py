@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import tempfile
+from urllib.parse import urlparse
+from flask import request, current_app
+from utils.rate_limit_storage import storage_from_url
+
+logger = logging.getLogger(__name__)
+
+# Headers that may carry a caller-chosen idempotency key, in order of preference
+IDEMPOTENCY_HEADERS = ('Idempotency-Key', 'X-Idempotency-Key')
+
+# Longest key accepted; longer keys are ignored rather than stored
+MAX_KEY_LENGTH = 256
+
+# Slots in a dedup mmap table derived from the rate limit URL; each marker
+# stays for IDEMPOTENCY_TTL, so this is sized for a day of events
+DEFAULT_MMAP_SLOTS = 262144
+
+# Dedup storage, resolved from IDEMPOTENCY_STORAGE_URL on first use
+idempotency_store = None
+
+# Counters for inbound event deduplication
+idempotency_stats = {
+    'checked': 0,
+    'duplicates': 0,
+    'without_key': 0
+}
+
+def default_storage_url(ratelimit_url):
+    """
+    Derive dedup storage from the rate limit storage URL
+    
+    Markers live for a day, so in the rate limiter's fixed-size mmap table they
+    would crowd out (and evict) rate limit counters; an mmap URL gets its own
+    file instead. Memory and Redis storage keep markers apart already.
+    """
+    parsed = urlparse(ratelimit_url or 'memory://')
+    if parsed.scheme != 'mmap':
+        return ratelimit_url or 'memory://'
+    
+    if parsed.path:
+        root, ext = os.path.splitext(parsed.path)
+        path = f"{root}-idempotency{ext}"
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'wither-idempotency.mmap')
+    
+    return f"mmap://{path}?slots={DEFAULT_MMAP_SLOTS}"
+
+def get_idempotency_store():
+    """Get the storage backend that remembers seen idempotency keys"""
+    global idempotency_store
+    
+    if idempotency_store is None:
+        config = current_app.config
+        url = config.get('IDEMPOTENCY_STORAGE_URL') or default_storage_url(config.get('RATELIMIT_STORAGE_URL'))
+        idempotency_store = storage_from_url(url)
+        logger.info(f"Using idempotency storage {url}")
+    
+    return idempotency_store
+
+def get_idempotency_key(data=None, field=None, from_headers=True):
+    """
+    Find the idempotency key for an inbound event
+    
+    A header wins (unless from_headers is False, e.g. for one line of a bulk
+    request); otherwise the key is read from the given payload field, such as
+    the event_id the bot platform puts on every event.
+    """
+    key = None
+    if from_headers:
+        for header in IDEMPOTENCY_HEADERS:
+            key = request.headers.get(header)
+            if key:
+                break
+    
+    if not key and field and isinstance(data, dict):
+        key = data.get(field)
+    
+    if key is None or isinstance(key, (dict, list, bool)):
+        return None
+    
+    key = str(key).strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    
+    return key
+
+def claim_idempotency_key(scope, key):
+    """
+    Record an idempotency key as seen
+    
+    Returns:
+        bool: True the first time a key is seen within IDEMPOTENCY_TTL, False for duplicates
+    """
+    if key is None:
+        idempotency_stats['without_key'] += 1
+        return True
+    
+    idempotency_stats['checked'] += 1
+    
+    try:
+        first = get_idempotency_store().add(
+            f"idempotency:{scope}:{key}", current_app.config.get('IDEMPOTENCY_TTL', 86400), time.time()
+        )
+    except Exception as e:
+        # Better to risk a duplicate than to drop an event
+        logger.error(f"Idempotency check failed, accepting event: {str(e)}")
+        return True
+    
+    if not first:
+        idempotency_stats['duplicates'] += 1
+        logger.info(f"Ignoring duplicate {scope} event with idempotency key {key}")
+    
+    return first
+
+def release_idempotency_key(scope, key):
+    """Forget a claimed key so a retry of an event that failed to process is accepted"""
+    if key is None:
+        return
+    
+    try:
+        get_idempotency_store().discard(f"idempotency:{scope}:{key}")
+    except Exception as e:
+        logger.error(f"Failed to release idempotency key {key}: {str(e)}")
+
+def get_idempotency_stats():
+    """Get deduplication counters for this worker"""
+    stats = dict(idempotency_stats)
+    stats['hit_rate'] = round(stats['duplicates'] / stats['checked'], 4) if stats['checked'] else 0.0
+    
+    return stats
@@ -1,11 +1,180 @@
 import time
+import queue
+import atexit
+import random
 import logging
+import datetime
+import threading
 from functools import wraps
 from flask import request, g
+from sqlalchemy import insert
 from models import db, RequestLog
+from utils.analytics import rollup_aggregator
 
 logger = logging.getLogger(__name__)
 
+# Queued by RequestLogWriter.stop to wake the writer thread
+_STOP = object()
+
+class RequestLogWriter(threading.Thread):
+    """
+    Background writer that bulk-inserts request logs in batches
+    
+    Requests only push a dict onto a bounded queue. When the queue is full the
+    overflow policy decides what happens:
+        drop    discard the new record
+        sample  once the queue is half full, keep 1 in sample_rate records
+        block   wait up to block_timeout seconds for room, then discard
+    """
+    
+    def __init__(self, app=None, max_queue=10000, batch_size=500, flush_interval=2.0,
+                 overflow='drop', sample_rate=10, block_timeout=0.05):
+        super().__init__(name='request-log-writer', daemon=True)
+        self.app = app
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.block_timeout = block_timeout
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'sampled_out': 0,
+            'batches': 0,
+            'failed_batches': 0
+        }
+        self._stop_event = threading.Event()
+    
+    def submit(self, record):
+        """Queue a log record without blocking the request (unless overflow is 'block')"""
+        if self.overflow == 'sample' and self.queue.qsize() >= self.queue.maxsize // 2:
+            if random.randrange(self.sample_rate):
+                self.stats['sampled_out'] += 1
+                return False
+        
+        try:
+            if self.overflow == 'block':
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        
+        self.stats['enqueued'] += 1
+        return True
+    
+    def _next_batch(self):
+        """Collect records until the batch is full or the flush interval passes"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if record is _STOP:
+                break
+            batch.append(record)
+        
+        return batch
+    
+    def write(self, batch):
+        """Insert a batch of records with a single executemany and update rollups"""
+        if not batch:
+            return
+        
+        for record in batch:
+            rollup_aggregator.add(record, record.pop('route', None))
+        
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(RequestLog), batch)
+                db.session.commit()
+                self.stats['written'] += len(batch)
+                self.stats['batches'] += 1
+            except Exception as e:
+                db.session.rollback()
+                self.stats['failed_batches'] += 1
+                self.stats['dropped'] += len(batch)
+                logger.error(f"Failed to write {len(batch)} request logs: {str(e)}")
+    
+    def write_rollups(self, force=False):
+        """Write per-minute rollups for minutes that are over"""
+        with self.app.app_context():
+            rollup_aggregator.flush(force)
+    
+    def run(self):
+        while not self._stop_event.is_set():
+            self.write(self._next_batch())
+            self.write_rollups()
+    
+    def flush(self):
+        """Write everything currently queued"""
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    record = self.queue.get_nowait()
+                    if record is not _STOP:
+                        batch.append(record)
+            except queue.Empty:
+                pass
+            
+            self.write(batch)
+            if len(batch) < self.batch_size:
+                break
+    
+    def stop(self, timeout=None):
+        """Stop the writer and flush whatever is still queued"""
+        self._stop_event.set()
+        if self.is_alive():
+            try:
+                self.queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            self.join(timeout)
+        self.flush()
+        self.write_rollups(force=True)
+    
+    def get_stats(self):
+        """Return queue depth and counters"""
+        return dict(self.stats, queued=self.queue.qsize(), max_queue=self.queue.maxsize)
+
+
+# Started by start_request_log_writer; records are discarded until then
+request_log_writer = None
+
+def start_request_log_writer(app):
+    """Start the background request log writer for this worker"""
+    global request_log_writer
+    
+    request_log_writer = RequestLogWriter(
+        app,
+        max_queue=app.config.get('REQUEST_LOG_QUEUE_SIZE', 10000),
+        batch_size=app.config.get('REQUEST_LOG_BATCH_SIZE', 500),
+        flush_interval=app.config.get('REQUEST_LOG_FLUSH_INTERVAL', 2.0),
+        overflow=app.config.get('REQUEST_LOG_OVERFLOW', 'drop'),
+        sample_rate=app.config.get('REQUEST_LOG_SAMPLE_RATE', 10)
+    )
+    request_log_writer.start()
+    atexit.register(request_log_writer.stop, timeout=request_log_writer.flush_interval)
+    
+    return request_log_writer
+
+def get_request_log_stats():
+    """Get request log queue counters"""
+    if request_log_writer is None:
+        return {'queued': 0}
+    
+    return request_log_writer.get_stats()
+
 def log_request(f):
     """Decorator to log API requests"""
     @wraps(f)
@@ -24,26 +193,25 @@ def log_request(f):
             if isinstance(response, tuple):
                 status_code = response[1] if len(response) >= 2 else 200
             else:
-                status_code = 200
-            
-            # Create log entry
-            log_entry = RequestLog(
-                method=request.method,
-                endpoint=request.path,
-                ip_address=request.remote_addr,
-                user_agent=request.user_agent.string,
-                user_id=g.user.id if hasattr(g, 'user') else None,
-                status_code=status_code,
-                response_time=response_time
-            )
-            
-            db.session.add(log_entry)
-            db.session.commit()
+                status_code = getattr(response, 'status_code', 200)
             
+            # Queue the log entry; it is written by the background writer
+            if request_log_writer is not None:
+                request_log_writer.submit({
+                    'method': request.method,
+                    'endpoint': request.path[:256],
+                    'route': request.url_rule.rule if request.url_rule else None,
+                    'ip_address': request.remote_addr,
+                    'user_agent': request.user_agent.string[:256],
+                    'user_id': g.user.id if hasattr(g, 'user') else None,
+                    'status_code': status_code,
+                    'response_time': response_time,
+                    'timestamp': datetime.datetime.utcnow()
+                })
+        
         except Exception as e:
-            logger.error(f"Failed to log request: {str(e)}")
             # Don't let logging failures affect the response
-            db.session.rollback()
+            logger.error(f"Failed to log request: {str(e)}")
         
         return response
     
@@ -0,0 +1,31 @@
+import json
+
+def read_ndjson(stream, max_line):
+    """
+    Parse newline-delimited JSON from a stream one line at a time
+    
+    Yields:
+        tuple: (line number, parsed object or None, error message or None)
+    """
+    line_number = 0
+    
+    while True:
+        line = stream.readline(max_line + 1)
+        if not line:
+            return
+        line_number += 1
+        
+        if len(line) > max_line and not line.endswith(b'\n'):
+            # Skip the rest of the oversized line without holding it in memory
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_line + 1)
+            yield line_number, None, f'Line is longer than {max_line} bytes'
+            continue
+        
+        if not line.strip():
+            continue
+        
+        try:
+            yield line_number, json.loads(line), None
+        except ValueError:
+            yield line_number, None, 'Invalid JSON'
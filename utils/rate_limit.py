@@ -1,12 +1,25 @@
 import time
 from functools import wraps
-from flask import request, jsonify, g
+from flask import request, jsonify, g, make_response, current_app
 import logging
+from utils.rate_limit_storage import storage_from_url
+from utils.rate_limit_policy import policy_table
 
 logger = logging.getLogger(__name__)
 
-# Simple in-memory rate limiting storage
-rate_limit_store = {}
+# Rate limit storage, resolved from RATELIMIT_STORAGE_URL on first use
+rate_limit_store = None
+
+def get_rate_limit_store():
+    """Get the rate limit storage backend configured for the app"""
+    global rate_limit_store
+    
+    if rate_limit_store is None:
+        url = current_app.config.get('RATELIMIT_STORAGE_URL', 'memory://')
+        rate_limit_store = storage_from_url(url)
+        logger.info(f"Using rate limit storage {url}")
+    
+    return rate_limit_store
 
 def get_rate_limit_key(request):
     """Get a unique key for rate limiting based on API key or IP address"""
@@ -26,88 +39,60 @@ def rate_limit(f):
         # Get current time
         now = time.time()
         
-        # Clean up old requests
-        clean_rate_limit_store(now)
+        # Get rate limit settings from the compiled policy table
+        config = current_app.config
+        policy_table.refresh(config.get('RATELIMIT_POLICY_REFRESH', 60))
+        policy = policy_table.resolve(getattr(g, 'user', None), request.endpoint, config)
         
-        # Get rate limit settings
-        # Different limits for authenticated vs unauthenticated requests
-        if hasattr(g, 'user'):
-            # Authenticated users get higher limits
-            max_requests = 100
-            window_size = 60  # 1 minute
-        else:
-            # Unauthenticated users get lower limits
-            max_requests = 20
-            window_size = 60  # 1 minute
+        store = get_rate_limit_store()
+        max_requests = policy.rate.limit
+        allowed, remaining, retry_after, reset_at = store.hit(
+            key, max_requests, policy.rate.window, now, policy.cost
+        )
         
-        # Initialize or get the requests for this key
-        if key not in rate_limit_store:
-            rate_limit_store[key] = []
-        
-        # Get requests in the current time window
-        requests_in_window = [req_time for req_time in rate_limit_store[key] if req_time > now - window_size]
+        # Routes with their own policy get a separate per-caller budget as well
+        if allowed and policy.route_rate:
+            route_allowed, route_remaining, retry_after, route_reset_at = store.hit(
+                f"{key}:{request.endpoint}", policy.route_rate.limit, policy.route_rate.window, now, policy.cost
+            )
+            if not route_allowed:
+                # Don't charge the caller's budget for a request that is refused
+                store.refund(key, policy.rate.window, now, policy.cost)
+            if not route_allowed or route_remaining < remaining:
+                allowed, remaining, reset_at = route_allowed, route_remaining, route_reset_at
+                max_requests = policy.route_rate.limit
         
         # Check if rate limit is exceeded
-        if len(requests_in_window) >= max_requests:
-            # Calculate time until reset
-            reset_time = min(rate_limit_store[key]) + window_size - now
-            
+        if not allowed:
             # Set rate limit headers
             headers = {
                 'X-RateLimit-Limit': str(max_requests),
                 'X-RateLimit-Remaining': '0',
-                'X-RateLimit-Reset': str(int(reset_time)),
-                'Retry-After': str(int(reset_time))
+                'X-RateLimit-Reset': str(retry_after),
+                'Retry-After': str(retry_after)
             }
             
             logger.warning(f"Rate limit exceeded for {key}")
             
-            return jsonify({
+            response = make_response(jsonify({
                 'status': 'error',
                 'message': 'Rate limit exceeded. Please try again later.'
-            }), 429, headers
-        
-        # Add current request to the store
-        rate_limit_store[key].append(now)
+            }), 429)
+            response.headers.update(headers)
+            return response
         
         # Set rate limit headers
-        remaining = max_requests - len(requests_in_window) - 1
         headers = {
             'X-RateLimit-Limit': str(max_requests),
             'X-RateLimit-Remaining': str(remaining),
-            'X-RateLimit-Reset': str(int(now + window_size))
+            'X-RateLimit-Reset': str(int(reset_at))
         }
         
-        # Call the original function
-        response = f(*args, **kwargs)
-        
-        # Add headers to the response
-        if isinstance(response, tuple):
-            # Response with status code (and possibly headers)
-            if len(response) == 3:
-                # Response, status code, headers
-                resp, status, resp_headers = response
-                resp_headers.update(headers)
-                return resp, status, resp_headers
-            else:
-                # Response, status code
-                resp, status = response
-                return resp, status, headers
-        else:
-            # Only response object
-            return response, 200, headers
+        # Call the original function and add headers to the response.
+        # A full Response object is returned so Flask-RESTful resources
+        # pass it through untouched.
+        response = make_response(f(*args, **kwargs))
+        response.headers.update(headers)
+        return response
     
     return decorated
-
-def clean_rate_limit_store(now):
-    """Clean up old requests from the rate limit store"""
-    # Maximum age to keep in store (2 hours)
-    max_age = 7200
-    
-    for key in list(rate_limit_store.keys()):
-        # Filter out old requests
-        rate_limit_store[key] = [req_time for req_time in rate_limit_store[key] if req_time > now - max_age]
-        
-        # Remove empty keys
-        if not rate_limit_store[key]:
-            del rate_limit_store[key]
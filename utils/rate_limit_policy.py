@@ -0,0 +1,142 @@
+import re
+import time
+import logging
+import threading
+from collections import namedtuple
+from sqlalchemy import event
+from models import RateLimitPolicy
+
+logger = logging.getLogger(__name__)
+
+# A limit compiled from a policy string such as "100 per minute"
+Rate = namedtuple('Rate', ['limit', 'window'])
+
+# Limits and costs that apply to a single request
+ResolvedPolicy = namedtuple('ResolvedPolicy', ['rate', 'cost', 'route_rate'])
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400
+}
+
+RATE_PATTERN = re.compile(
+    r'^\s*(\d+)\s*(?:per|/)\s*(\d+)?\s*(second|minute|hour|day)s?\s*$',
+    re.IGNORECASE
+)
+
+def parse_rate(value):
+    """
+    Parse a rate limit string into a Rate
+    
+    Accepts "100 per minute", "1000 per hour", "5/second" or "50 per 10 minutes".
+    """
+    match = RATE_PATTERN.match(value or '')
+    if not match:
+        raise ValueError(f"Invalid rate limit: {value!r}")
+    
+    count, multiplier, period = match.groups()
+    return Rate(int(count), int(multiplier or 1) * PERIODS[period.lower()])
+
+
+class PolicyTable:
+    """In-memory index of rate limit policies, reloaded when they change"""
+    
+    def __init__(self):
+        self.by_api_key = {}
+        self.by_user = {}
+        self.by_endpoint = {}
+        self.loaded_at = None
+        self.dirty = True
+        self._lock = threading.Lock()
+    
+    def invalidate(self):
+        """Force a reload on the next lookup"""
+        self.dirty = True
+    
+    def load(self):
+        """Compile every policy row into lookup dictionaries"""
+        by_api_key, by_user, by_endpoint = {}, {}, {}
+        
+        for policy in RateLimitPolicy.query.all():
+            try:
+                rate = parse_rate(policy.limit) if policy.limit else None
+            except ValueError as e:
+                logger.error(f"Ignoring rate limit policy {policy.id}: {str(e)}")
+                continue
+            
+            if policy.api_key_id is not None:
+                if rate:
+                    by_api_key[policy.api_key_id] = rate
+            elif policy.user_id is not None:
+                if rate:
+                    by_user[policy.user_id] = rate
+            elif policy.endpoint:
+                by_endpoint[policy.endpoint] = (policy.cost, rate)
+        
+        self.by_api_key, self.by_user, self.by_endpoint = by_api_key, by_user, by_endpoint
+        logger.info(f"Loaded {len(by_api_key) + len(by_user) + len(by_endpoint)} rate limit policies")
+    
+    def refresh(self, max_age):
+        """Reload the table if it changed locally or is older than max_age seconds"""
+        now = time.monotonic()
+        if not self.dirty and self.loaded_at is not None and now - self.loaded_at < max_age:
+            return
+        
+        with self._lock:
+            if not self.dirty and self.loaded_at is not None and now - self.loaded_at < max_age:
+                return
+            
+            # Clear the flags first so a failing database is retried after
+            # max_age instead of on every request
+            self.dirty = False
+            self.loaded_at = now
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Failed to load rate limit policies: {str(e)}")
+    
+    def resolve(self, principal, endpoint, config):
+        """
+        Resolve the limits for a request without touching the database
+        
+        Args:
+            principal: Authenticated principal, or None for anonymous callers
+            endpoint: Flask endpoint name of the route
+            config: App configuration holding the defaults
+        
+        Returns:
+            ResolvedPolicy: Caller rate, request cost and optional route rate
+        """
+        if principal is not None:
+            rate = self.by_api_key.get(principal.api_key_id) or self.by_user.get(principal.id)
+            rate = rate or parse_default(config.get('RATELIMIT_DEFAULT'))
+        else:
+            rate = parse_default(config.get('RATELIMIT_ANONYMOUS'))
+        
+        cost, route_rate = self.by_endpoint.get(endpoint, (None, None))
+        if cost is None:
+            cost = config.get('RATELIMIT_ROUTE_COSTS', {}).get(endpoint, 1)
+        
+        return ResolvedPolicy(rate, cost, route_rate)
+
+
+_default_rates = {}
+
+def parse_default(value):
+    """Parse a configured default rate once and memoise it"""
+    rate = _default_rates.get(value)
+    if rate is None:
+        rate = _default_rates[value] = parse_rate(value)
+    return rate
+
+
+policy_table = PolicyTable()
+
+@event.listens_for(RateLimitPolicy, 'after_insert')
+@event.listens_for(RateLimitPolicy, 'after_update')
+@event.listens_for(RateLimitPolicy, 'after_delete')
+def _on_policy_changed(mapper, connection, target):
+    """Reload the policy table after a policy is written in this process"""
+    policy_table.invalidate()
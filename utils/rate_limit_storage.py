@@ -0,0 +1,697 @@
+import os
+import math
+import mmap
+import fcntl
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Expired entries reaped per hit; each entry is reaped at most once, so the
+# amortised cleanup cost per request stays constant
+EVICT_PER_HIT = 2
+
+
+def sliding_window(prev_count, curr_count, window_start, limit, window, now, cost):
+    """
+    Apply the sliding-window-counter algorithm to one key
+    
+    The previous fixed window is weighted by how much of it still overlaps the
+    sliding window, which approximates a true sliding log in constant space.
+    
+    Returns:
+        tuple: (allowed, remaining, retry_after) where retry_after is in seconds
+    """
+    elapsed = now - window_start
+    weight = (window - elapsed) / window
+    estimated = prev_count * weight + curr_count
+    
+    if estimated + cost > limit:
+        # Time until enough of the previous window has slid out
+        budget = limit - curr_count - cost
+        if budget >= 0 and prev_count:
+            retry_after = window * (1 - budget / prev_count) - elapsed
+        else:
+            retry_after = window - elapsed
+        return False, 0, max(1, math.ceil(retry_after))
+    
+    return True, max(0, int(limit - estimated - cost)), 0
+
+
+class MemoryStorage:
+    """
+    Per-process rate limit storage using sliding window counters
+    
+    Each key holds two counters and a window start, so every hit is O(1)
+    regardless of the window size or the number of tracked clients.
+    """
+    
+    # Cap on add() markers kept per process; the oldest are dropped first
+    MAX_MARKERS = 100000
+    
+    def __init__(self):
+        # key -> [window_start, prev_count, curr_count, window], least recently hit first
+        self._entries = OrderedDict()
+        # key -> expiry time, oldest first
+        self._markers = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def hit(self, key, limit, window, now, cost=1):
+        """
+        Count a request against a key
+        
+        Args:
+            key: Rate limit key (e.g. "user:1")
+            limit: Maximum requests allowed per window
+            window: Window size in seconds
+            now: Current unix time
+            cost: Weight of this request
+        
+        Returns:
+            tuple: (allowed, remaining, retry_after, reset_at)
+        """
+        window_start = now - (now % window)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            
+            if entry is None or entry[3] != window:
+                entry = [window_start, 0, 0, window]
+                self._entries[key] = entry
+            
+            result = self._hit_entry(key, entry, limit, window, window_start, now, cost)
+            self._evict_expired(now, EVICT_PER_HIT)
+        
+        return result
+    
+    def _hit_entry(self, key, entry, limit, window, window_start, now, cost):
+        """Apply a hit to an exact entry; the caller holds the lock"""
+        if entry[0] != window_start:
+            # Roll forward: the current window becomes the previous one,
+            # unless more than a whole window has passed since the last hit
+            entry[1] = entry[2] if entry[0] == window_start - window else 0
+            entry[2] = 0
+            entry[0] = window_start
+        self._entries.move_to_end(key)
+        
+        allowed, remaining, retry_after = sliding_window(
+            entry[1], entry[2], window_start, limit, window, now, cost
+        )
+        if allowed:
+            entry[2] += cost
+        
+        return allowed, remaining, retry_after, window_start + window
+    
+    def refund(self, key, window, now, cost=1):
+        """Give back units charged by an admitted hit in the current window"""
+        window_start = now - (now % window)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == window_start and entry[3] == window:
+                entry[2] = max(0, entry[2] - cost)
+    
+    def add(self, key, ttl, now):
+        """
+        Store a marker for key unless one is already live
+        
+        Returns:
+            bool: True if the key was added, False if it was already present
+        """
+        with self._lock:
+            expires_at = self._markers.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+            
+            self._markers.pop(key, None)
+            self._markers[key] = now + ttl
+            
+            # Markers are mostly added with the same TTL, so the oldest are
+            # the first to expire
+            for _ in range(EVICT_PER_HIT):
+                oldest, expires_at = next(iter(self._markers.items()))
+                if expires_at > now and len(self._markers) <= self.MAX_MARKERS:
+                    break
+                del self._markers[oldest]
+        
+        return True
+    
+    def discard(self, key):
+        """Remove a marker stored by add"""
+        with self._lock:
+            self._markers.pop(key, None)
+    
+    def _evict_expired(self, now, budget=None):
+        """Drop least recently hit entries whose counters have fully expired"""
+        evicted = 0
+        
+        while self._entries and (budget is None or evicted < budget):
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] + 2 * entry[3] > now:
+                break
+            del self._entries[key]
+            evicted += 1
+        
+        return evicted
+    
+    def cleanup(self, now):
+        """Remove every expired entry"""
+        with self._lock:
+            return self._evict_expired(now)
+    
+    def reset(self):
+        """Forget all rate limit state"""
+        with self._lock:
+            self._entries.clear()
+            self._markers.clear()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def stats(self):
+        """Return storage occupancy"""
+        return {
+            'backend': 'memory',
+            'tracked_keys': len(self._entries),
+            'markers': len(self._markers)
+        }
+
+
+class WindowedSketch:
+    """Count-min sketches of the current and previous fixed window for one window size"""
+    
+    def __init__(self, width, depth, window, window_start):
+        self.width = width
+        self.depth = depth
+        self.window = window
+        self.window_start = window_start
+        self.prev = self._new_table()
+        self.curr = self._new_table()
+        self.prev_total = 0
+        self.curr_total = 0
+    
+    def _new_table(self):
+        return array('I', bytes(self.width * self.depth * array('I').itemsize))
+    
+    def roll(self, window_start):
+        """Advance to the window starting at window_start"""
+        if window_start == self.window_start:
+            return
+        
+        if window_start == self.window_start + self.window:
+            self.prev, self.prev_total = self.curr, self.curr_total
+        else:
+            self.prev, self.prev_total = self._new_table(), 0
+        self.curr, self.curr_total = self._new_table(), 0
+        self.window_start = window_start
+    
+    def indexes(self, key):
+        """Counter positions for a key, one per row (Kirsch-Mitzenmacher double hashing)"""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+    
+    def estimate(self, indexes):
+        """Upper-bound estimates of a key's previous and current window counts"""
+        return min(self.prev[i] for i in indexes), min(self.curr[i] for i in indexes)
+    
+    def add(self, indexes, amount, current=None):
+        """Conservative update: only raise counters that are below the new estimate"""
+        curr = self.curr
+        if current is None:
+            current = min(curr[i] for i in indexes)
+        target = current + amount
+        for i in indexes:
+            if curr[i] < target:
+                curr[i] = target
+        self.curr_total += amount
+    
+    @property
+    def nbytes(self):
+        return 2 * self.width * self.depth * self.curr.itemsize
+
+
+class BoundedMemoryStorage(MemoryStorage):
+    """
+    Per-process rate limit storage with a hard cap on tracked keys
+    
+    Keys are counted approximately in count-min sketches until their
+    estimated usage reaches promote_ratio of their limit, after which they
+    get an exact sliding window entry. At most max_keys exact entries are
+    kept; the least recently hit one is folded back into the sketch when
+    the cap is reached. Memory therefore stays fixed no matter how many
+    source addresses a spray uses. Sketch estimates only ever overcount,
+    so the long tail can be limited slightly early but never late.
+    """
+    
+    # Rough CPython footprint of one exact entry (dict slot, key string, list)
+    ENTRY_BYTES = 240
+    
+    def __init__(self, max_keys=10000, sketch_width=65536, sketch_depth=4, promote_ratio=0.5):
+        super().__init__()
+        self.max_keys = max_keys
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.promote_ratio = promote_ratio
+        self.promotions = 0
+        self.demotions = 0
+        self._sketches = {}
+    
+    def _sketch(self, window, window_start):
+        sketch = self._sketches.get(window)
+        if sketch is None:
+            sketch = self._sketches[window] = WindowedSketch(
+                self.sketch_width, self.sketch_depth, window, window_start
+            )
+        sketch.roll(window_start)
+        return sketch
+    
+    def hit(self, key, limit, window, now, cost=1):
+        """Count a request against a key (see MemoryStorage.hit)"""
+        window_start = now - (now % window)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            
+            if entry is not None and entry[3] == window:
+                result = self._hit_entry(key, entry, limit, window, window_start, now, cost)
+            else:
+                result = self._hit_sketch(key, limit, window, window_start, now, cost)
+            
+            self._evict_expired(now, EVICT_PER_HIT)
+        
+        return result
+    
+    def _hit_sketch(self, key, limit, window, window_start, now, cost):
+        """Apply a hit to an untracked key, promoting it if it is a heavy hitter"""
+        sketch = self._sketch(window, window_start)
+        indexes = sketch.indexes(key)
+        prev_count, curr_count = sketch.estimate(indexes)
+        
+        allowed, remaining, retry_after = sliding_window(
+            prev_count, curr_count, window_start, limit, window, now, cost
+        )
+        if allowed:
+            sketch.add(indexes, cost, curr_count)
+            curr_count += cost
+        
+        weight = (window - (now - window_start)) / window
+        if prev_count * weight + curr_count >= self.promote_ratio * limit:
+            self._entries[key] = [window_start, prev_count, curr_count, window]
+            self.promotions += 1
+            
+            if len(self._entries) > self.max_keys:
+                self._demote_oldest()
+        
+        return allowed, remaining, retry_after, window_start + window
+    
+    def _demote_oldest(self):
+        """Fold the least recently hit exact entry back into its sketch"""
+        key, (window_start, _, curr_count, window) = self._entries.popitem(last=False)
+        self.demotions += 1
+        
+        sketch = self._sketches.get(window)
+        if sketch is not None and sketch.window_start == window_start and curr_count:
+            sketch.add(sketch.indexes(key), curr_count)
+    
+    def reset(self):
+        """Forget all rate limit state"""
+        with self._lock:
+            self._entries.clear()
+            self._markers.clear()
+            self._sketches.clear()
+    
+    def stats(self):
+        """Return occupancy, memory use and sketch accuracy"""
+        exact_bytes = len(self._entries) * self.ENTRY_BYTES
+        sketch_bytes = sum(sketch.nbytes for sketch in self._sketches.values())
+        epsilon = math.e / self.sketch_width
+        
+        return {
+            'backend': 'memory',
+            'mode': 'bounded',
+            'tracked_keys': len(self._entries),
+            'markers': len(self._markers),
+            'max_keys': self.max_keys,
+            'promotions': self.promotions,
+            'demotions': self.demotions,
+            'sketch': {
+                'width': self.sketch_width,
+                'depth': self.sketch_depth,
+                'windows': sorted(self._sketches),
+                # With probability 1 - delta a sketch estimate exceeds the true
+                # count by at most epsilon x the window's total traffic
+                'epsilon': round(epsilon, 8),
+                'delta': round(math.exp(-self.sketch_depth), 6),
+                'max_overcount': {
+                    window: round(epsilon * sketch.curr_total, 2)
+                    for window, sketch in self._sketches.items()
+                }
+            },
+            'memory_bytes': {
+                'exact': exact_bytes,
+                'sketch': sketch_bytes,
+                'total': exact_bytes + sketch_bytes
+            }
+        }
+
+
+class MmapStorage:
+    """
+    Rate limit storage shared by all worker processes on one host
+    
+    Sliding window counters live in a fixed-size open-addressing table in a
+    memory-mapped file. Each hit takes an exclusive flock on the file, so
+    every gunicorn worker sees and updates the same counters atomically.
+    """
+    
+    MAGIC = b'WRL1'
+    HEADER = struct.Struct('<4sI')
+    # fingerprint, window_start, prev_count, curr_count, window
+    SLOT = struct.Struct('<Qdddd')
+    MAX_PROBE = 16
+    
+    def __init__(self, path=None, slots=65536):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'wither-ratelimit.mmap')
+        self.slots = slots
+        self.size = self.HEADER.size + self.SLOT.size * slots
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._map = None
+    
+    def _open(self):
+        """Map the shared file, re-opening after a fork so flock stays per-process"""
+        if self._pid == os.getpid():
+            return
+        
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, self.HEADER.pack(self.MAGIC, self.slots), 0)
+            magic, slots = self.HEADER.unpack(os.pread(fd, self.HEADER.size, 0))
+            if magic != self.MAGIC or slots != self.slots:
+                raise ValueError(f"Rate limit file {self.path} has an incompatible layout")
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        
+        self._file = fd
+        self._map = mmap.mmap(fd, self.size)
+        self._pid = os.getpid()
+    
+    @staticmethod
+    def fingerprint(key):
+        """Stable 64-bit, non-zero fingerprint of a key shared by all processes"""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+    
+    def _offset(self, index):
+        return self.HEADER.size + self.SLOT.size * index
+    
+    def _find_slot(self, fp, now):
+        """Return the offset for a key, claiming a free or expired slot if needed"""
+        start = fp % self.slots
+        candidate = None
+        oldest = None
+        
+        for probe in range(self.MAX_PROBE):
+            offset = self._offset((start + probe) % self.slots)
+            slot_fp, window_start, _, _, window = self.SLOT.unpack_from(self._map, offset)
+            
+            if slot_fp == fp:
+                return offset, True
+            if slot_fp == 0 or window_start + 2 * window <= now:
+                if candidate is None:
+                    candidate = offset
+                if slot_fp == 0:
+                    break
+            elif oldest is None or window_start < oldest[1]:
+                oldest = (offset, window_start)
+        
+        if candidate is None:
+            # Probe run is full of live keys; sacrifice the stalest one
+            candidate = oldest[0]
+            self.evictions += 1
+        
+        return candidate, False
+    
+    def _lookup(self, fp):
+        """Return the offset of a key's slot, or None; never claims or evicts a slot"""
+        start = fp % self.slots
+        
+        for probe in range(self.MAX_PROBE):
+            offset = self._offset((start + probe) % self.slots)
+            slot_fp = self.SLOT.unpack_from(self._map, offset)[0]
+            if slot_fp == fp:
+                return offset
+            if slot_fp == 0:
+                break
+        
+        return None
+    
+    def hit(self, key, limit, window, now, cost=1):
+        """Count a request against a key (see MemoryStorage.hit)"""
+        fp = self.fingerprint(key)
+        window_start = now - (now % window)
+        
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                offset, found = self._find_slot(fp, now)
+                prev_count = curr_count = 0
+                
+                if found:
+                    _, slot_start, prev_count, curr_count, slot_window = self.SLOT.unpack_from(self._map, offset)
+                    if slot_window != window:
+                        prev_count = curr_count = 0
+                    elif slot_start != window_start:
+                        prev_count = curr_count if slot_start == window_start - window else 0
+                        curr_count = 0
+                
+                allowed, remaining, retry_after = sliding_window(
+                    prev_count, curr_count, window_start, limit, window, now, cost
+                )
+                if allowed:
+                    curr_count += cost
+                
+                self.SLOT.pack_into(self._map, offset, fp, window_start, prev_count, curr_count, window)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        
+        return allowed, remaining, retry_after, window_start + window
+    
+    def refund(self, key, window, now, cost=1):
+        """Give back units charged by an admitted hit in the current window"""
+        fp = self.fingerprint(key)
+        window_start = now - (now % window)
+        
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                offset, found = self._find_slot(fp, now)
+                if found:
+                    _, slot_start, prev_count, curr_count, slot_window = self.SLOT.unpack_from(self._map, offset)
+                    if slot_start == window_start and slot_window == window:
+                        self.SLOT.pack_into(
+                            self._map, offset, fp, slot_start, prev_count, max(0, curr_count - cost), slot_window
+                        )
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+    
+    def add(self, key, ttl, now):
+        """Store a marker for key unless one is already live (see MemoryStorage.add)"""
+        fp = self.fingerprint(key)
+        
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                offset, found = self._find_slot(fp, now)
+                if found:
+                    _, slot_start, _, _, slot_window = self.SLOT.unpack_from(self._map, offset)
+                    if slot_start + 2 * slot_window > now:
+                        return False
+                
+                # A marker is a slot whose "window" ends when the TTL does
+                self.SLOT.pack_into(self._map, offset, fp, now, 0, 0, ttl / 2)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        
+        return True
+    
+    def discard(self, key):
+        """Remove a marker stored by add"""
+        fp = self.fingerprint(key)
+        
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                offset = self._lookup(fp)
+                if offset is not None:
+                    self.SLOT.pack_into(self._map, offset, fp, 0, 0, 0, 0)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+    
+    def cleanup(self, now):
+        """Clear every expired slot"""
+        evicted = 0
+        
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                for index in range(self.slots):
+                    offset = self._offset(index)
+                    slot_fp, window_start, _, _, window = self.SLOT.unpack_from(self._map, offset)
+                    if slot_fp and window_start + 2 * window <= now:
+                        # Leave a tombstone so probe chains past this slot stay intact
+                        self.SLOT.pack_into(self._map, offset, slot_fp, 0, 0, 0, 0)
+                        evicted += 1
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        
+        return evicted
+    
+    def reset(self):
+        """Forget all rate limit state for every process"""
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                self._map[self.HEADER.size:] = bytes(self.size - self.HEADER.size)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+    
+    def stats(self):
+        """Return table geometry and local eviction count"""
+        return {
+            'backend': 'mmap',
+            'path': self.path,
+            'slots': self.slots,
+            'bytes': self.size,
+            'evictions': self.evictions
+        }
+
+
+class RedisStorage:
+    """
+    Rate limit storage in Redis, shared by every worker on every host
+    
+    Each key keeps one counter per fixed window. The increment happens before
+    the limit check inside a MULTI/EXEC block and is rolled back on
+    rejection, so concurrent workers can never admit more than the limit.
+    """
+    
+    def __init__(self, url, prefix='ratelimit:'):
+        if redis is None:
+            raise RuntimeError("The redis package is required for redis:// rate limit storage")
+        
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+    
+    def _counter_key(self, key, window, window_start):
+        return f"{self.prefix}{key}:{int(window)}:{int(window_start // window)}"
+    
+    def hit(self, key, limit, window, now, cost=1):
+        """Count a request against a key (see MemoryStorage.hit)"""
+        window_start = now - (now % window)
+        curr_key = self._counter_key(key, window, window_start)
+        prev_key = self._counter_key(key, window, window_start - window)
+        
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incrby(curr_key, cost)
+        pipe.expire(curr_key, int(2 * window))
+        pipe.get(prev_key)
+        curr_count, _, prev_count = pipe.execute()
+        
+        allowed, remaining, retry_after = sliding_window(
+            int(prev_count or 0), curr_count - cost, window_start, limit, window, now, cost
+        )
+        if not allowed:
+            self.client.decrby(curr_key, cost)
+        
+        return allowed, remaining, retry_after, window_start + window
+    
+    def refund(self, key, window, now, cost=1):
+        """Give back units charged by an admitted hit in the current window"""
+        window_start = now - (now % window)
+        self.client.decrby(self._counter_key(key, window, window_start), cost)
+    
+    def add(self, key, ttl, now):
+        """Store a marker for key unless one is already live (see MemoryStorage.add)"""
+        return bool(self.client.set(f"{self.prefix}{key}", 1, nx=True, ex=max(1, math.ceil(ttl))))
+    
+    def discard(self, key):
+        """Remove a marker stored by add"""
+        self.client.delete(f"{self.prefix}{key}")
+    
+    def cleanup(self, now):
+        """Redis expires counters on its own"""
+        return 0
+    
+    def reset(self):
+        """Forget all rate limit state"""
+        for key in self.client.scan_iter(match=f"{self.prefix}*"):
+            self.client.delete(key)
+    
+    def stats(self):
+        """Return backend information"""
+        return {
+            'backend': 'redis',
+            'prefix': self.prefix
+        }
+
+
+def storage_from_url(url):
+    """
+    Create rate limit storage from a RATELIMIT_STORAGE_URL
+    
+    Supported URLs:
+        memory://                          Per-process counters
+        memory://?max_keys=10000           Per-process, exact for heavy hitters and
+                                           sketched for the rest (sketch_width,
+                                           sketch_depth and promote_ratio are optional)
+        mmap:///path/to/file?slots=65536   Counters shared by processes on one host
+        redis://host:6379/0                Counters shared through Redis
+    """
+    parsed = urlparse(url or 'memory://')
+    options = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+    
+    if parsed.scheme == 'memory':
+        if 'max_keys' in options:
+            return BoundedMemoryStorage(
+                max_keys=int(options['max_keys']),
+                sketch_width=int(options.get('sketch_width', 65536)),
+                sketch_depth=int(options.get('sketch_depth', 4)),
+                promote_ratio=float(options.get('promote_ratio', 0.5))
+            )
+        return MemoryStorage()
+    
+    if parsed.scheme == 'mmap':
+        return MmapStorage(
+            path=parsed.path or None,
+            slots=int(options.get('slots', 65536))
+        )
+    
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisStorage(url)
+    
+    raise ValueError(f"Unsupported rate limit storage URL: {url}")
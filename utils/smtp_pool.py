@@ -0,0 +1,266 @@
+import os
+import time
+import logging
+import smtplib
+import threading
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a connection can't be trusted for another message
+# (SMTP errors are OSErrors too, so handle those first)
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, OSError)
+
+class SMTPConnectionPool:
+    """
+    Thread-safe pool of logged-in SMTP connections to one relay
+    
+    Connections are handed out most recently used first, so a quiet worker
+    keeps reusing one warm session and the rest age out. A connection idle for
+    longer than idle_timeout is closed; one idle for longer than check_after is
+    checked with NOOP before it is handed out. At most max_size connections
+    exist at once; callers wait for a free one beyond that.
+    """
+    
+    def __init__(self, host, port, use_tls=False, username=None, password=None,
+                 max_size=4, idle_timeout=60, check_after=10, timeout=30, wait=10):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.timeout = timeout
+        self.wait = wait
+        
+        # (connection, released at) pairs, most recently used last
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self.counters = {
+            'connects': 0,
+            'sends': 0,
+            'reused': 0,
+            'noop_checks': 0,
+            'noop_failures': 0,
+            'expired': 0,
+            'reconnects': 0,
+            'errors': 0
+        }
+    
+    def _count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+    
+    def _connect(self):
+        """Open, secure and log in a new connection"""
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                connection.starttls()
+            if self.username and self.password:
+                connection.login(self.username, self.password)
+        except Exception:
+            self._close(connection)
+            raise
+        
+        self._count('connects')
+        return connection
+    
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except Exception:
+            connection.close()
+    
+    def _discard(self, connection):
+        """Close a connection and free its slot"""
+        self._close(connection)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+    
+    def _prune(self, now):
+        """Remove connections idle for longer than idle_timeout; call with the lock held"""
+        expired = [connection for connection, released in self._idle if now - released > self.idle_timeout]
+        if expired:
+            self._idle = [(connection, released) for connection, released in self._idle
+                          if now - released <= self.idle_timeout]
+            self._open -= len(expired)
+            self.counters['expired'] += len(expired)
+            self._cond.notify(len(expired))
+        
+        return expired
+    
+    def acquire(self):
+        """
+        Get a healthy connection, reusing an idle one where possible
+        
+        Returns:
+            tuple: (connection, reused) where reused is False for a new connection
+        """
+        deadline = time.monotonic() + self.wait
+        
+        while True:
+            with self._cond:
+                expired = self._prune(time.monotonic())
+                
+                if self._idle:
+                    connection, released = self._idle.pop()
+                    idle_for = time.monotonic() - released
+                elif self._open < self.max_size:
+                    self._open += 1
+                    connection = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No SMTP connection to {self.host} free after {self.wait}s")
+                    self._cond.wait(remaining)
+                    continue
+            
+            for stale in expired:
+                self._close(stale)
+            
+            if connection is None:
+                try:
+                    return self._connect(), False
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+            
+            if idle_for <= self.check_after:
+                return connection, True
+            
+            # The relay may have dropped a connection that sat idle for a while
+            self._count('noop_checks')
+            try:
+                if connection.noop()[0] == 250:
+                    return connection, True
+            except CONNECTION_ERRORS + (smtplib.SMTPException,):
+                pass
+            
+            self._count('noop_failures')
+            self._discard(connection)
+    
+    def release(self, connection, healthy=True):
+        """Return a connection to the pool, or close it if it can't be reused"""
+        if not healthy:
+            self._discard(connection)
+            return
+        
+        with self._cond:
+            self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+    
+    def send(self, sender, recipients, message):
+        """
+        Send one message over a pooled connection
+        
+        If a reused connection turns out to be dead, the message is retried once
+        on a fresh one. Errors about the message itself (refused recipients,
+        rejected data) leave the connection in the pool.
+        
+        Returns:
+            dict: Recipients the relay refused, as returned by sendmail
+        """
+        for attempt in range(2):
+            connection, reused = self.acquire()
+            try:
+                refused = connection.sendmail(sender, recipients, message)
+            except smtplib.SMTPResponseException as e:
+                # 421 means the relay is closing the connection
+                self.release(connection, healthy=e.smtp_code != 421)
+                self._count('errors')
+                raise
+            except smtplib.SMTPRecipientsRefused:
+                # sendmail has already reset the session
+                self.release(connection)
+                self._count('errors')
+                raise
+            except CONNECTION_ERRORS:
+                self.release(connection, healthy=False)
+                if reused and attempt == 0:
+                    self._count('reconnects')
+                    continue
+                self._count('errors')
+                raise
+            except Exception:
+                self.release(connection, healthy=False)
+                self._count('errors')
+                raise
+            
+            self.release(connection)
+            with self._cond:
+                self.counters['sends'] += 1
+                if reused:
+                    self.counters['reused'] += 1
+            return refused
+    
+    def close(self):
+        """Close all idle connections"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify(len(idle))
+        
+        for connection, _ in idle:
+            self._close(connection)
+    
+    def stats(self):
+        """Return connection counts and reuse counters"""
+        with self._cond:
+            stats = dict(self.counters)
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        
+        stats['reuse_rate'] = round(stats['reused'] / stats['sends'], 4) if stats['sends'] else 0.0
+        return stats
+
+
+# Pools per relay for this process, created on first use
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+def get_smtp_pool():
+    """Get the connection pool for the configured SMTP relay"""
+    global _pools, _pools_pid
+    
+    config = current_app.config
+    key = (config.get('MAIL_SERVER'), config.get('MAIL_PORT'), config.get('MAIL_USERNAME'))
+    
+    pool = _pools.get(key) if _pools_pid == os.getpid() else None
+    if pool is None:
+        with _pools_lock:
+            # Sockets must not be shared with a forked parent, so each worker builds its own
+            if _pools_pid != os.getpid():
+                _pools, _pools_pid = {}, os.getpid()
+            
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = SMTPConnectionPool(
+                    key[0], key[1],
+                    use_tls=config.get('MAIL_USE_TLS'),
+                    username=config.get('MAIL_USERNAME'),
+                    password=config.get('MAIL_PASSWORD'),
+                    max_size=config.get('MAIL_POOL_SIZE', 4),
+                    idle_timeout=config.get('MAIL_POOL_IDLE_TIMEOUT', 60),
+                    check_after=config.get('MAIL_POOL_CHECK_AFTER', 10),
+                    timeout=config.get('MAIL_TIMEOUT', 30),
+                    wait=config.get('MAIL_POOL_WAIT', 10)
+                )
+    
+    return pool
+
+def get_smtp_pool_stats():
+    """Get connection reuse stats for each SMTP relay used by this process"""
+    if _pools_pid != os.getpid():
+        return {}
+    
+    return {f"{host}:{port}": pool.stats() for (host, port, _), pool in list(_pools.items())}
@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+class RelayRateLimiter:
+    """
+    Token bucket for one SMTP relay with an AIMD send rate
+    
+    Each send takes a token; tokens refill at the current rate up to burst.
+    Each round of accepted messages as large as the current rate (about a
+    second's worth) raises the rate by increase messages per second (additive
+    increase); every throttle reply multiplies it by decrease (multiplicative
+    decrease) and empties the bucket, so senders back off at once and then
+    creep back up linearly to what the relay tolerates.
+    """
+    
+    def __init__(self, rate=5.0, min_rate=0.2, max_rate=50.0, increase=0.1, decrease=0.5, burst=5):
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.accepted = 0  # Accepted messages towards the next increase
+        self.updated = time.monotonic()
+        self.counters = {'sent': 0, 'throttled': 0, 'waits': 0, 'deferred': 0}
+        self.last_throttle_at = None
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        """Add the tokens earned since the last update; call with the lock held"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def try_acquire(self):
+        """
+        Take a token if one is available
+        
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one will be
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            
+            return (1 - self.tokens) / self.rate
+    
+    def acquire(self, max_wait):
+        """
+        Take a token, sleeping for it if that takes no longer than max_wait seconds
+        
+        Returns:
+            float: 0 once a token was taken, otherwise the wait that was refused
+        """
+        deadline = time.monotonic() + max_wait
+        
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return 0.0
+            
+            if time.monotonic() + wait > deadline:
+                with self._lock:
+                    self.counters['deferred'] += 1
+                return wait
+            
+            with self._lock:
+                self.counters['waits'] += 1
+            time.sleep(wait)
+    
+    def record_success(self):
+        """Count an accepted message, increasing the rate once per round of rate messages"""
+        with self._lock:
+            self.counters['sent'] += 1
+            self.accepted += 1
+            if self.accepted >= self.rate:
+                self.accepted = 0
+                self.rate = min(self.max_rate, self.rate + self.increase)
+    
+    def record_throttle(self):
+        """Multiplicative decrease after a throttle reply"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.counters['throttled'] += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            self.accepted = 0
+            self.last_throttle_at = time.time()
+            rate = self.rate
+        
+        logger.warning(f"SMTP relay is throttling; slowing down to {rate:.2f} messages/s")
+    
+    def stats(self):
+        """Return the current rate and send/throttle counters"""
+        with self._lock:
+            self._refill(time.monotonic())
+            stats = dict(self.counters)
+            stats['rate'] = round(self.rate, 3)
+            stats['tokens'] = round(self.tokens, 3)
+            stats['last_throttle_at'] = self.last_throttle_at
+        
+        return stats
+
+
+# Rate limiters per relay for this process, created on first use
+_limiters = {}
+_limiters_pid = None
+_limiters_lock = threading.Lock()
+
+def get_relay_limiter():
+    """Get the rate limiter for the configured SMTP relay"""
+    global _limiters, _limiters_pid
+    
+    config = current_app.config
+    key = (config.get('MAIL_SERVER'), config.get('MAIL_PORT'), config.get('MAIL_USERNAME'))
+    
+    limiter = _limiters.get(key) if _limiters_pid == os.getpid() else None
+    if limiter is None:
+        with _limiters_lock:
+            if _limiters_pid != os.getpid():
+                _limiters, _limiters_pid = {}, os.getpid()
+            
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _limiters[key] = RelayRateLimiter(
+                    rate=config.get('MAIL_RATE_INITIAL', 5.0),
+                    min_rate=config.get('MAIL_RATE_MIN', 0.2),
+                    max_rate=config.get('MAIL_RATE_MAX', 50.0),
+                    increase=config.get('MAIL_RATE_INCREASE', 0.1),
+                    decrease=config.get('MAIL_RATE_DECREASE', 0.5),
+                    burst=config.get('MAIL_RATE_BURST', 5)
+                )
+    
+    return limiter
+
+def get_relay_rate_stats():
+    """Get the send rate and throttle counts for each SMTP relay used by this process"""
+    if _limiters_pid != os.getpid():
+        return {}
+    
+    return {f"{host}:{port}": limiter.stats() for (host, port, _), limiter in list(_limiters.items())}
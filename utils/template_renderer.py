@@ -0,0 +1,114 @@
+import re
+import logging
+from collections import namedtuple
+from flask import current_app
+from models import db, EmailTemplate
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# {{name}} placeholder; the name is used exactly as written, like the old str.replace
+PLACEHOLDER = re.compile(r'\{\{([^{}]*)\}\}')
+
+# Result of rendering a template for one recipient
+Rendered = namedtuple('Rendered', ['subject', 'body', 'missing', 'unknown'])
+
+def compile_text(text):
+    """
+    Split text into alternating literal and placeholder segments
+    
+    Returns:
+        tuple: Literals at even indices, placeholder names at odd indices
+    """
+    return tuple(PLACEHOLDER.split(text))
+
+def render_segments(segments, values):
+    """Join compiled segments, leaving placeholders without a value as written"""
+    parts = list(segments)
+    for index in range(1, len(parts), 2):
+        name = parts[index]
+        parts[index] = values[name] if name in values else '{{' + name + '}}'
+    
+    return ''.join(parts)
+
+
+class CompiledTemplate:
+    """Email template subject and body split into segments once, rendered in a single pass"""
+    
+    __slots__ = ('subject', 'body', 'variables')
+    
+    def __init__(self, subject, body):
+        self.subject = compile_text(subject)
+        self.body = compile_text(body)
+        self.variables = frozenset(self.subject[1::2] + self.body[1::2])
+    
+    def render(self, variables):
+        """
+        Fill the template for one recipient
+        
+        Returns:
+            Rendered: Subject and body, plus the placeholders that got no value
+            and the variables that match no placeholder (both sorted lists)
+        """
+        values = {name: str(variables[name]) for name in self.variables if name in variables}
+        
+        return Rendered(
+            render_segments(self.subject, values),
+            render_segments(self.body, values),
+            sorted(self.variables.difference(values)),
+            sorted(name for name in variables if name not in self.variables)
+        )
+
+
+# Compiled templates keyed by (template id, version), created lazily from the app configuration
+template_cache = None
+
+def get_template_cache():
+    """Get the compiled template cache, creating it from the app configuration"""
+    global template_cache
+    
+    if template_cache is None:
+        template_cache = TTLCache(
+            maxsize=current_app.config.get('MAIL_TEMPLATE_CACHE_SIZE', 1000),
+            ttl=current_app.config.get('MAIL_TEMPLATE_CACHE_TTL', 3600)
+        )
+    
+    return template_cache
+
+def get_compiled_template(template_id, user_id):
+    """
+    Get a user's template, compiled
+    
+    Only the version is read on a cache hit. Every edit bumps the version, so
+    an edit made through another worker is never rendered stale.
+    
+    Returns:
+        CompiledTemplate: None if the template does not exist or belongs to someone else
+    """
+    version = db.session.query(EmailTemplate.version).filter_by(id=template_id, user_id=user_id).scalar()
+    if version is None:
+        return None
+    
+    cache = get_template_cache()
+    compiled = cache.get((template_id, version))
+    if compiled is None:
+        template = db.session.get(EmailTemplate, template_id)
+        if template is None:
+            # Deleted since its version was read
+            return None
+        compiled = CompiledTemplate(template.subject, template.body)
+        cache.set((template.id, template.version), compiled)
+    
+    return compiled
+
+def invalidate_template(template_id, version):
+    """Drop a compiled template version that was edited or deleted"""
+    if template_cache is not None:
+        template_cache.pop((template_id, version))
+
+def get_template_cache_stats():
+    """Get hit/miss counters for the compiled template cache"""
+    if template_cache is None:
+        return {'size': 0, 'hits': 0, 'misses': 0}
+    
+    return template_cache.stats()
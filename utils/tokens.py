@@ -0,0 +1,181 @@
+import json
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import threading
+from flask import current_app
+from models import db, TokenRevocation
+
+logger = logging.getLogger(__name__)
+
+# Access tokens look like "wat.<payload>.<signature>" so they can be told
+# apart from API keys (UUIDs) without a database lookup
+TOKEN_PREFIX = 'wat.'
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def _sign(message):
+    secret = current_app.config.get('SECRET_KEY', '')
+    return hmac.new(secret.encode('utf-8'), message.encode('ascii'), hashlib.sha256).digest()
+
+def is_access_token(credential):
+    """Check whether a bearer credential is a signed access token"""
+    return bool(credential) and credential.startswith(TOKEN_PREFIX)
+
+
+class RevocationList:
+    """
+    Key and user revocations for outstanding access tokens
+    
+    Revocations are stored in the database so every worker process applies
+    them. Each process keeps them in memory and reloads the recent ones at
+    most every refresh seconds, so verifying a token only touches the database
+    once per interval, and a revocation made by another worker takes effect
+    within that interval.
+    """
+    
+    def __init__(self):
+        self._keys = {}
+        self._users = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+    
+    def revoke_key(self, key_id, max_age):
+        """Reject tokens for a key issued at or before now"""
+        self._revoke(TokenRevocation.KIND_KEY, key_id, max_age)
+    
+    def revoke_user(self, user_id, max_age):
+        """Reject tokens for a user issued at or before now"""
+        self._revoke(TokenRevocation.KIND_USER, user_id, max_age)
+    
+    def _revoke(self, kind, ident, max_age):
+        """Record a revocation in the session, to be committed with the change that caused it"""
+        now = int(time.time())
+        
+        # Called from attribute events too, where a flush would be premature
+        with db.session.no_autoflush:
+            revocation = TokenRevocation.query.filter_by(kind=kind, ident=ident).first()
+        if revocation is None:
+            db.session.add(TokenRevocation(kind=kind, ident=ident, revoked_at=now))
+        else:
+            revocation.revoked_at = now
+        
+        with self._lock:
+            self._table(kind)[ident] = now
+            self._prune(now - max_age)
+    
+    def _table(self, kind):
+        return self._keys if kind == TokenRevocation.KIND_KEY else self._users
+    
+    def _prune(self, cutoff):
+        """Drop entries older than the token lifetime; call with the lock held"""
+        for table in (self._keys, self._users):
+            for stale in [i for i, revoked_at in table.items() if revoked_at < cutoff]:
+                del table[stale]
+    
+    def refresh(self, max_age, interval):
+        """Load revocations made by other workers if the last load is older than interval seconds"""
+        now = time.time()
+        if self._loaded_at is not None and now - self._loaded_at < interval:
+            return
+        
+        # One thread reloads; the others keep using what is loaded
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._loaded_at = now
+            cutoff = int(now) - max_age
+            rows = db.session.query(
+                TokenRevocation.kind, TokenRevocation.ident, TokenRevocation.revoked_at
+            ).filter(TokenRevocation.revoked_at >= cutoff).all()
+            
+            self._prune(cutoff)
+            for kind, ident, revoked_at in rows:
+                table = self._table(kind)
+                table[ident] = max(table.get(ident, 0), revoked_at)
+        except Exception as e:
+            # Keep the revocations already loaded rather than failing requests
+            logger.error(f"Failed to load token revocations: {str(e)}")
+        finally:
+            self._lock.release()
+    
+    def is_revoked(self, user_id, key_id, issued_at):
+        """Check whether a token was issued before a matching revocation"""
+        key_revoked_at = self._keys.get(key_id)
+        if key_revoked_at is not None and issued_at <= key_revoked_at:
+            return True
+        
+        user_revoked_at = self._users.get(user_id)
+        return user_revoked_at is not None and issued_at <= user_revoked_at
+    
+    def __len__(self):
+        return len(self._keys) + len(self._users)
+
+
+revocation_list = RevocationList()
+
+def issue_access_token(user_id, api_key_id, ttl=None):
+    """
+    Issue a short-lived signed access token for an API key
+    
+    Args:
+        user_id: Id of the user owning the key
+        api_key_id: Id of the API key being exchanged
+        ttl: Token lifetime in seconds (defaults to ACCESS_TOKEN_TTL)
+    
+    Returns:
+        tuple: The token string and its expiry as a unix timestamp
+    """
+    ttl = ttl or current_app.config.get('ACCESS_TOKEN_TTL', 900)
+    issued_at = int(time.time())
+    expires_at = issued_at + ttl
+    
+    payload = _b64encode(json.dumps({
+        'uid': user_id,
+        'kid': api_key_id,
+        'iat': issued_at,
+        'exp': expires_at
+    }, separators=(',', ':')).encode('utf-8'))
+    
+    message = TOKEN_PREFIX + payload
+    return f"{message}.{_b64encode(_sign(message))}", expires_at
+
+def verify_access_token(token):
+    """
+    Verify an access token, touching the database only to reload revocations
+    
+    Returns:
+        dict: The token claims, or None if the token is invalid, expired or revoked
+    """
+    try:
+        message, signature = token.rsplit('.', 1)
+        if not hmac.compare_digest(_b64decode(signature), _sign(message)):
+            return None
+        
+        claims = json.loads(_b64decode(message[len(TOKEN_PREFIX):]))
+    except (ValueError, TypeError):
+        return None
+    
+    if claims.get('exp', 0) <= time.time():
+        return None
+    
+    config = current_app.config
+    revocation_list.refresh(config.get('ACCESS_TOKEN_TTL', 900), config.get('ACCESS_TOKEN_REVOCATION_REFRESH', 5))
+    if revocation_list.is_revoked(claims.get('uid'), claims.get('kid'), claims.get('iat', 0)):
+        return None
+    
+    return claims
+
+def revoke_api_key_tokens(api_key_id):
+    """Revoke outstanding access tokens issued for an API key; the caller commits"""
+    revocation_list.revoke_key(api_key_id, current_app.config.get('ACCESS_TOKEN_TTL', 900))
+
+def revoke_user_tokens(user_id):
+    """Revoke outstanding access tokens issued to a user; the caller commits"""
+    revocation_list.revoke_user(user_id, current_app.config.get('ACCESS_TOKEN_TTL', 900))
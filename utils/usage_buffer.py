@@ -0,0 +1,84 @@
+import datetime
+import logging
+import threading
+from sqlalchemy import bindparam, or_, update
+from models import db, ApiKey
+from utils.background import start_periodic_worker
+
+logger = logging.getLogger(__name__)
+
+class LastUsedBuffer:
+    """Write-behind buffer holding the latest last_used_at per API key"""
+    
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.flushed = 0
+    
+    def record(self, key_id, when=None):
+        """Remember that a key was used, keeping only the newest timestamp"""
+        when = when or datetime.datetime.utcnow()
+        
+        with self._lock:
+            current = self._pending.get(key_id)
+            if current is None or when > current:
+                self._pending[key_id] = when
+            self.recorded += 1
+    
+    def drain(self):
+        """Take all pending timestamps out of the buffer"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        return pending
+    
+    def restore(self, pending):
+        """Put timestamps back after a failed flush without losing newer ones"""
+        for key_id, when in pending.items():
+            self.record(key_id, when)
+    
+    def flush(self):
+        """Write all pending timestamps with a single bulk UPDATE"""
+        pending = self.drain()
+        
+        if not pending:
+            return 0
+        
+        # Never move a timestamp backwards if another worker wrote a newer one
+        table = ApiKey.__table__
+        statement = update(table).where(
+            table.c.id == bindparam('key_id'),
+            or_(table.c.last_used_at.is_(None), table.c.last_used_at < bindparam('used_at'))
+        ).values(last_used_at=bindparam('used_at'))
+        
+        try:
+            db.session.execute(statement, [
+                {'key_id': key_id, 'used_at': when} for key_id, when in pending.items()
+            ])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.restore(pending)
+            raise
+        
+        self.flushed += len(pending)
+        logger.debug(f"Flushed last_used_at for {len(pending)} API keys")
+        
+        return len(pending)
+    
+    def stats(self):
+        """Return buffer counters"""
+        return {
+            'pending': len(self._pending),
+            'recorded': self.recorded,
+            'flushed': self.flushed
+        }
+
+
+last_used_buffer = LastUsedBuffer()
+
+def start_last_used_flusher(app):
+    """Start the background thread that flushes buffered last_used_at values"""
+    interval = app.config.get('API_KEY_USAGE_FLUSH_INTERVAL', 10)
+    return start_periodic_worker(app, 'last-used-flusher', interval, last_used_buffer.flush)
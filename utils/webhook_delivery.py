@@ -0,0 +1,410 @@
+import os
+import json
+import hmac
+import uuid
+import socket
+import hashlib
+import logging
+import datetime
+from collections import Counter
+from urllib.parse import urlparse
+from flask import current_app
+from sqlalchemy import or_, and_, func, update
+from models import db, WebhookEndpoint, WebhookEvent, WebhookDelivery
+from utils.backoff import compute_backoff
+from utils.background import start_periodic_worker
+from utils.webhook_dispatcher import dispatch_webhooks
+from utils.webhook_health import CIRCUIT_CLOSED, allow_delivery, record_outcome
+from utils.webhook_scheduler import fair_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process when claiming deliveries
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def add_deliveries(webhooks, event_type, envelope, now):
+    """
+    Add the event and one pending delivery per endpoint to the session
+    
+    The envelope is encoded a single time; every endpoint is sent (and
+    signed over) exactly these bytes. Deliveries to batching endpoints wait
+    for their batch to fill or linger out. Nothing is committed.
+    
+    Args:
+        webhooks: Matching WebhookEndpoint rows
+        event_type: Event name
+        envelope: Payload dict to send
+        now: Time the event was received
+    
+    Returns:
+        list: The new WebhookDelivery rows
+    """
+    event = WebhookEvent(
+        event_type=event_type[:128],
+        body=json.dumps(envelope, separators=(',', ':'))
+    )
+    
+    deliveries = [
+        WebhookDelivery(
+            webhook_id=webhook.id,
+            user_id=webhook.user_id,
+            webhook_event=event,
+            event=event.event_type,
+            next_attempt_at=now + datetime.timedelta(seconds=webhook.batch_linger if webhook.batch_max_size else 0)
+        )
+        for webhook in webhooks
+    ]
+    
+    db.session.add_all(deliveries)
+    return deliveries
+
+def enqueue_deliveries(webhooks, event_type, envelope):
+    """
+    Persist the event once and one pending delivery per endpoint
+    
+    Returns:
+        list: The created WebhookDelivery rows
+    """
+    now = datetime.datetime.utcnow()
+    deliveries = add_deliveries(webhooks, event_type, envelope, now)
+    db.session.commit()
+    
+    return deliveries
+
+def find_due_batches(pending, now):
+    """
+    Find batching endpoints with a batch ready to send
+    
+    An endpoint is ready once its oldest queued delivery has lingered out, or
+    as soon as a full batch has queued up while its circuit is closed.
+    Deliveries that have never been attempted count towards the batch
+    whatever their linger; retries wait for their backoff.
+    
+    Returns:
+        list: (webhook_id, user_id, url, batch_max_size, ready, requests, oldest) tuples,
+        ready being the deliveries that may go in a batch now
+    """
+    rows = db.session.query(
+        WebhookDelivery.webhook_id, WebhookDelivery.user_id, WebhookEndpoint.url,
+        WebhookEndpoint.batch_max_size, WebhookEndpoint.circuit_state,
+        func.count(WebhookDelivery.id), func.min(WebhookDelivery.next_attempt_at)
+    ).join(WebhookEndpoint, WebhookEndpoint.id == WebhookDelivery.webhook_id).filter(
+        pending,
+        WebhookEndpoint.batch_max_size.isnot(None),
+        or_(WebhookDelivery.next_attempt_at <= now, WebhookDelivery.attempts == 0)
+    ).group_by(
+        WebhookDelivery.webhook_id, WebhookDelivery.user_id, WebhookEndpoint.url,
+        WebhookEndpoint.batch_max_size, WebhookEndpoint.circuit_state
+    )
+    
+    batches = []
+    for webhook_id, user_id, url, max_size, circuit_state, count, oldest in rows:
+        if oldest <= now:
+            requests_ready = -(-count // max_size)
+        elif count >= max_size and circuit_state == CIRCUIT_CLOSED:
+            requests_ready = count // max_size
+            # A full batch is due now, however long its deliveries may still linger
+            oldest = now
+        else:
+            continue
+        batches.append((webhook_id, user_id, url, max_size, count, requests_ready, oldest))
+    
+    return batches
+
+def claim_due_deliveries(limit, lease_seconds):
+    """
+    Claim due deliveries, so no other worker sends them
+    
+    The limit counts requests: a delivery to a regular endpoint is one, and
+    so is a batch of up to batch_max_size deliveries to a batching endpoint.
+    Requests are shared between users by the fair scheduler, within each
+    user's concurrency cap, and no destination host gets more than
+    WEBHOOK_HOST_CONCURRENCY of them, so one tenant's burst to slow
+    endpoints cannot hold up everyone else's deliveries.
+    
+    Returns:
+        list: Claimed WebhookDelivery rows
+    """
+    config = current_app.config
+    now = datetime.datetime.utcnow()
+    claimable = or_(WebhookDelivery.locked_until.is_(None), WebhookDelivery.locked_until < now)
+    pending = and_(WebhookDelivery.status == WebhookDelivery.STATUS_PENDING, claimable)
+    due_single = and_(
+        pending,
+        WebhookDelivery.next_attempt_at <= now,
+        WebhookEndpoint.batch_max_size.is_(None)
+    )
+    
+    backlog = {
+        user_id: (count, oldest)
+        for user_id, count, oldest in db.session.query(
+            WebhookDelivery.user_id, func.count(WebhookDelivery.id), func.min(WebhookDelivery.next_attempt_at)
+        ).join(WebhookEndpoint, WebhookEndpoint.id == WebhookDelivery.webhook_id).filter(
+            due_single
+        ).group_by(WebhookDelivery.user_id)
+    }
+    
+    batches = find_due_batches(pending, now)
+    for webhook_id, user_id, url, max_size, ready, requests_ready, oldest in batches:
+        count, user_oldest = backlog.get(user_id, (0, oldest))
+        backlog[user_id] = (count + requests_ready, min(user_oldest, oldest))
+    
+    # Requests in flight per user across workers; a claimed batch is one request
+    in_flight = Counter()
+    for user_id, max_size, count in db.session.query(
+        WebhookDelivery.user_id, WebhookEndpoint.batch_max_size, func.count(WebhookDelivery.id)
+    ).join(WebhookEndpoint, WebhookEndpoint.id == WebhookDelivery.webhook_id).filter(
+        WebhookDelivery.status == WebhookDelivery.STATUS_PENDING,
+        WebhookDelivery.locked_until >= now
+    ).group_by(WebhookDelivery.user_id, WebhookDelivery.webhook_id, WebhookDelivery.claimed_by, WebhookEndpoint.batch_max_size):
+        in_flight[user_id] += -(-count // max_size) if max_size else count
+    
+    fair_scheduler.observe(backlog, in_flight, now)
+    quotas = fair_scheduler.allocate(
+        {user_id: count for user_id, (count, _) in backlog.items()}, in_flight, limit, config
+    )
+    if not quotas:
+        return []
+    
+    # Each selected user's requests in queue order: (oldest, delivery id or None, webhook id, url)
+    queues = {user_id: [] for user_id in quotas}
+    for webhook_id, user_id, url, max_size, ready, requests_ready, oldest in batches:
+        if user_id in queues:
+            queues[user_id].extend([(oldest, None, webhook_id, url)] * requests_ready)
+    
+    # Oldest due single deliveries of each selected user, at most a quota's worth per user
+    rank = func.row_number().over(
+        partition_by=WebhookDelivery.user_id,
+        order_by=(WebhookDelivery.next_attempt_at, WebhookDelivery.id)
+    ).label('rank')
+    ranked = db.session.query(
+        WebhookDelivery.id, WebhookDelivery.user_id, WebhookDelivery.webhook_id,
+        WebhookDelivery.next_attempt_at, WebhookEndpoint.url, rank
+    ).join(WebhookEndpoint, WebhookEndpoint.id == WebhookDelivery.webhook_id).filter(
+        due_single, WebhookDelivery.user_id.in_(list(quotas))
+    ).subquery()
+    for row in db.session.query(ranked).filter(ranked.c.rank <= max(quotas.values())):
+        queues[row.user_id].append((row.next_attempt_at, row.id, row.webhook_id, row.url))
+    
+    for queue in queues.values():
+        queue.sort(key=lambda request: (request[0], request[1] or 0))
+    
+    # Walk the queues a position at a time so users are interleaved
+    host_cap = config.get('WEBHOOK_HOST_CONCURRENCY', 8)
+    hosts = Counter()
+    taken = Counter()
+    ids = []
+    batch_requests = Counter()
+    for position in range(max((len(queue) for queue in queues.values()), default=0)):
+        for user_id, queue in queues.items():
+            if position >= len(queue) or taken[user_id] >= quotas[user_id]:
+                continue
+            
+            _, delivery_id, webhook_id, url = queue[position]
+            host = urlparse(url).netloc.lower()
+            if hosts[host] >= host_cap:
+                continue
+            hosts[host] += 1
+            taken[user_id] += 1
+            if delivery_id is None:
+                batch_requests[webhook_id] += 1
+            else:
+                ids.append(delivery_id)
+    
+    fair_scheduler.settle(quotas, taken)
+    
+    # A ready batch takes the endpoint's oldest deliveries, lingering or not
+    max_sizes = {webhook_id: max_size for webhook_id, _, _, max_size, _, _, _ in batches}
+    for webhook_id, requests_taken in batch_requests.items():
+        ids.extend(delivery_id for delivery_id, in db.session.query(WebhookDelivery.id).filter(
+            WebhookDelivery.webhook_id == webhook_id,
+            pending,
+            or_(WebhookDelivery.next_attempt_at <= now, WebhookDelivery.attempts == 0)
+        ).order_by(WebhookDelivery.next_attempt_at, WebhookDelivery.id).limit(requests_taken * max_sizes[webhook_id]))
+    
+    if not ids:
+        return []
+    
+    # The conditional UPDATE is the claim; rows another worker got first are skipped
+    token = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    db.session.execute(
+        update(WebhookDelivery)
+        .where(WebhookDelivery.id.in_(ids), WebhookDelivery.status == WebhookDelivery.STATUS_PENDING, claimable)
+        .values(claimed_by=token, locked_until=now + datetime.timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    
+    deliveries = WebhookDelivery.query.filter_by(claimed_by=token).order_by(WebhookDelivery.id).all()
+    fair_scheduler.record_claimed(deliveries, now)
+    
+    return deliveries
+
+def sign_payload(secret, body):
+    """HMAC-SHA256 signature of the raw request body"""
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+class EventBodies:
+    """Encoded event bodies and their signatures, computed once per claimed batch"""
+    
+    def __init__(self, event_ids):
+        self.bodies = {
+            event.id: event.body.encode('utf-8')
+            for event in WebhookEvent.query.filter(WebhookEvent.id.in_(event_ids))
+        }
+        self.signatures = {}
+    
+    def build_request(self, webhook, group):
+        """
+        Build the body and headers for one request
+        
+        A batching endpoint gets a JSON array of the events in queue order,
+        joined from the already encoded bodies; others get the single event.
+        """
+        headers = {'Content-Type': 'application/json'}
+        
+        if webhook.batch_max_size:
+            body = b'[' + b','.join(self.bodies[delivery.event_id] for delivery in group) + b']'
+            headers['X-Webhook-Batch-Size'] = str(len(group))
+            if webhook.secret:
+                headers['X-Webhook-Signature'] = sign_payload(webhook.secret, body)
+            return body, headers
+        
+        delivery = group[0]
+        body = self.bodies[delivery.event_id]
+        
+        # Add signature if secret is set; endpoints sharing a secret share it
+        if webhook.secret:
+            key = (delivery.event_id, webhook.secret)
+            signature = self.signatures.get(key)
+            if signature is None:
+                signature = self.signatures[key] = sign_payload(webhook.secret, body)
+            headers['X-Webhook-Signature'] = signature
+        
+        return body, headers
+
+
+def record_result(delivery, result, config, retry_at=None):
+    """Update a delivery after an attempt, scheduling a retry (at retry_at, if given) or giving up"""
+    now = datetime.datetime.utcnow()
+    
+    delivery.attempts += 1
+    delivery.claimed_by = None
+    delivery.locked_until = None
+    delivery.last_status_code = result.get('status_code')
+    delivery.last_error = (result.get('error') or '')[:256] or None
+    
+    if result['status'] == 'success':
+        delivery.status = WebhookDelivery.STATUS_DELIVERED
+        delivery.delivered_at = now
+    elif delivery.attempts >= config.get('WEBHOOK_MAX_ATTEMPTS', 8):
+        delivery.status = WebhookDelivery.STATUS_DEAD
+        logger.warning(f"Webhook delivery {delivery.id} is dead after {delivery.attempts} attempts")
+    elif retry_at is not None:
+        delivery.next_attempt_at = retry_at
+    else:
+        delay = compute_backoff(
+            delivery.attempts,
+            config.get('WEBHOOK_RETRY_BASE_DELAY', 5),
+            config.get('WEBHOOK_RETRY_MAX_DELAY', 3600)
+        )
+        delivery.next_attempt_at = now + datetime.timedelta(seconds=delay)
+
+def defer(delivery, until):
+    """Put a delivery back in the queue without using up an attempt"""
+    delivery.claimed_by = None
+    delivery.locked_until = None
+    delivery.next_attempt_at = until
+
+def deliver(deliveries):
+    """Send claimed deliveries concurrently and record the outcomes"""
+    config = current_app.config
+    now = datetime.datetime.utcnow()
+    webhook_ids = {delivery.webhook_id for delivery in deliveries}
+    webhooks = {webhook.id: webhook for webhook in WebhookEndpoint.query.filter(WebhookEndpoint.id.in_(webhook_ids))}
+    bodies = EventBodies({delivery.event_id for delivery in deliveries})
+    
+    # One request per delivery, except batching endpoints which get up to
+    # batch_max_size deliveries per request (claimed rows are in queue order)
+    groups = []
+    open_batches = {}
+    for delivery in deliveries:
+        webhook = webhooks.get(delivery.webhook_id)
+        if webhook is None or not webhook.is_active:
+            record_result(delivery, {'status': 'error', 'error': 'Webhook endpoint is inactive'}, config)
+            delivery.status = WebhookDelivery.STATUS_DEAD
+            continue
+        
+        if not webhook.batch_max_size:
+            groups.append((webhook, [delivery]))
+            continue
+        
+        batch = open_batches.get(webhook.id)
+        if batch is None or len(batch) >= webhook.batch_max_size:
+            batch = open_batches[webhook.id] = []
+            groups.append((webhook, batch))
+        batch.append(delivery)
+    
+    sendable = []
+    requests_out = []
+    for webhook, group in groups:
+        # Endpoints with an open circuit are not called until it half-opens
+        retry_at = allow_delivery(webhook, now, config)
+        if retry_at is not None:
+            for delivery in group:
+                defer(delivery, retry_at)
+            continue
+        
+        body, headers = bodies.build_request(webhook, group)
+        sendable.append((webhook, group))
+        requests_out.append((webhook.id, webhook.url, body, headers))
+    
+    if requests_out:
+        for (webhook, group), result in zip(sendable, dispatch_webhooks(requests_out)):
+            finished = datetime.datetime.utcnow()
+            
+            # Deliveries sent together are retried together
+            retry_at = None
+            if len(group) > 1:
+                delay = compute_backoff(
+                    group[0].attempts + 1,
+                    config.get('WEBHOOK_RETRY_BASE_DELAY', 5),
+                    config.get('WEBHOOK_RETRY_MAX_DELAY', 3600)
+                )
+                retry_at = finished + datetime.timedelta(seconds=delay)
+            
+            for delivery in group:
+                record_result(delivery, result, config, retry_at)
+            record_outcome(webhook, result['status'] == 'success', result.get('elapsed'), finished, config)
+    
+    db.session.commit()
+
+def process_due_deliveries():
+    """
+    Claim and send due deliveries until no user has both backlog and room
+    
+    A short claim doesn't end the run: the per-user and per-host caps limit
+    how much each pass may claim, and every pass frees their slots again, so
+    passes follow one another until a claim comes back empty.
+    """
+    config = current_app.config
+    batch_size = config.get('WEBHOOK_DELIVERY_BATCH_SIZE', 50)
+    # The claim outlives the dispatch deadline, so a live worker never loses it
+    lease = config.get('WEBHOOK_DISPATCH_DEADLINE', 10) + 30
+    sent = 0
+    
+    while True:
+        deliveries = claim_due_deliveries(batch_size, lease)
+        if not deliveries:
+            break
+        
+        deliver(deliveries)
+        sent += len(deliveries)
+    
+    return sent
+
+def start_delivery_worker(app):
+    """Start the background thread that sends queued webhook deliveries"""
+    interval = app.config.get('WEBHOOK_DELIVERY_POLL_INTERVAL', 1)
+    return start_periodic_worker(app, 'webhook-delivery', interval, process_due_deliveries, run_on_stop=False)
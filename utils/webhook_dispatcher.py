@@ -0,0 +1,92 @@
+import time
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app
+from utils.http_client import get_http_session, get_timeout
+
+logger = logging.getLogger(__name__)
+
+# Shared pool for outbound webhook requests, created on first dispatch
+_executor = None
+
+def get_dispatch_executor():
+    """Get the bounded thread pool used for webhook fan-out"""
+    global _executor
+    
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=current_app.config.get('WEBHOOK_DISPATCH_WORKERS', 16),
+            thread_name_prefix='webhook-dispatch'
+        )
+    
+    return _executor
+
+def send_webhook(session, webhook_id, url, body, headers, timeout):
+    """Send one pre-encoded webhook body and describe the outcome"""
+    started = time.monotonic()
+    try:
+        response = session.post(url, data=body, headers=headers, timeout=timeout)
+        
+        return {
+            'webhook_id': webhook_id,
+            'status': 'success' if response.status_code < 400 else 'error',
+            'status_code': response.status_code,
+            'elapsed': time.monotonic() - started
+        }
+    
+    except requests.RequestException as e:
+        logger.error(f"Error dispatching webhook to {url}: {str(e)}")
+        return {
+            'webhook_id': webhook_id,
+            'status': 'error',
+            'error': str(e),
+            'elapsed': time.monotonic() - started
+        }
+
+def dispatch_webhooks(deliveries, timeout=None, deadline=None):
+    """
+    Send webhooks concurrently under one overall deadline
+    
+    Args:
+        deliveries: List of (webhook_id, url, body, headers) tuples, body being encoded JSON
+        timeout: Per-request timeout in seconds (defaults to WEBHOOK_TIMEOUT)
+        deadline: Seconds allowed for the whole fan-out (defaults to WEBHOOK_DISPATCH_DEADLINE)
+    
+    Returns:
+        list: One result per delivery, in the same order
+    """
+    timeout = timeout or current_app.config.get('WEBHOOK_TIMEOUT', 5)
+    deadline = deadline or current_app.config.get('WEBHOOK_DISPATCH_DEADLINE', 10)
+    
+    # No single request may outlive the fan-out deadline
+    timeout = get_timeout(min(timeout, deadline))
+    started = time.monotonic()
+    
+    # Resolved here because the pool threads run outside the app context
+    session = get_http_session()
+    executor = get_dispatch_executor()
+    futures = [
+        executor.submit(send_webhook, session, webhook_id, url, body, headers, timeout)
+        for webhook_id, url, body, headers in deliveries
+    ]
+    wait(futures, timeout=deadline)
+    
+    results = []
+    for future, (webhook_id, url, _, _) in zip(futures, deliveries):
+        if future.done():
+            results.append(future.result())
+            continue
+        
+        future.cancel()
+        logger.error(f"Webhook to {url} did not finish within the {deadline}s dispatch deadline")
+        results.append({
+            'webhook_id': webhook_id,
+            'status': 'error',
+            'error': 'Dispatch deadline exceeded',
+            'elapsed': deadline
+        })
+    
+    logger.debug(f"Dispatched {len(deliveries)} webhooks in {time.monotonic() - started:.3f}s")
+    
+    return results
@@ -0,0 +1,97 @@
+import random
+import logging
+import datetime
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+# Weight of the newest outcome in the success rate and latency averages
+EWMA_ALPHA = 0.1
+
+def allow_delivery(webhook, now, config):
+    """
+    Decide whether a delivery to this endpoint may be attempted now
+    
+    A closed circuit lets everything through. An open circuit blocks
+    deliveries until its cooldown has passed, then goes half-open and lets a
+    single probe through; further deliveries wait for that probe's outcome.
+    
+    Returns:
+        datetime: None if the delivery may go ahead, otherwise when to retry it
+    """
+    if webhook.circuit_state == CIRCUIT_CLOSED:
+        return None
+    
+    cooldown = datetime.timedelta(seconds=config.get('WEBHOOK_BREAKER_COOLDOWN', 60))
+    reopens_at = webhook.circuit_opened_at + cooldown
+    
+    if now < reopens_at:
+        # Spread deferred deliveries out so they don't all wake at once
+        return reopens_at + random.uniform(0, 0.1) * cooldown
+    
+    # Restarting the clock means another probe is only let through if this
+    # one never reports back within a cooldown
+    webhook.circuit_state = CIRCUIT_HALF_OPEN
+    webhook.circuit_opened_at = now
+    return None
+
+def record_outcome(webhook, success, latency, now, config):
+    """Update an endpoint's health after a delivery attempt and trip or reset its circuit"""
+    webhook.success_rate = (1 - EWMA_ALPHA) * webhook.success_rate + EWMA_ALPHA * int(success)
+    if latency is not None:
+        if webhook.latency_ewma is None:
+            webhook.latency_ewma = latency
+        else:
+            webhook.latency_ewma = (1 - EWMA_ALPHA) * webhook.latency_ewma + EWMA_ALPHA * latency
+    
+    if success:
+        if webhook.circuit_state != CIRCUIT_CLOSED:
+            logger.info(f"Closing circuit for webhook endpoint {webhook.id}")
+        webhook.circuit_state = CIRCUIT_CLOSED
+        webhook.circuit_opened_at = None
+        webhook.consecutive_failures = 0
+        webhook.failing_since = None
+        webhook.last_success_at = now
+        return
+    
+    webhook.consecutive_failures += 1
+    webhook.last_failure_at = now
+    if webhook.failing_since is None:
+        webhook.failing_since = now
+    
+    if webhook.circuit_state == CIRCUIT_HALF_OPEN or (
+            webhook.circuit_state == CIRCUIT_CLOSED and
+            webhook.consecutive_failures >= config.get('WEBHOOK_BREAKER_FAILURE_THRESHOLD', 5)):
+        logger.warning(f"Opening circuit for webhook endpoint {webhook.id} after {webhook.consecutive_failures} failures")
+        webhook.circuit_state = CIRCUIT_OPEN
+        webhook.circuit_opened_at = now
+    
+    disable_after = config.get('WEBHOOK_AUTO_DISABLE_AFTER', 86400)
+    if disable_after and now - webhook.failing_since >= datetime.timedelta(seconds=disable_after):
+        logger.warning(f"Disabling webhook endpoint {webhook.id}: failing since {webhook.failing_since.isoformat()}")
+        webhook.is_active = False
+        webhook.disabled_reason = 'Disabled automatically after repeated delivery failures'
+
+def reset_health(webhook):
+    """Close the circuit and forget past failures, e.g. when an endpoint is re-enabled"""
+    webhook.circuit_state = CIRCUIT_CLOSED
+    webhook.circuit_opened_at = None
+    webhook.consecutive_failures = 0
+    webhook.failing_since = None
+    webhook.disabled_reason = None
+
+def get_health(webhook):
+    """Describe an endpoint's delivery health"""
+    return {
+        'circuit_state': webhook.circuit_state,
+        'success_rate': round(webhook.success_rate, 4),
+        'latency_ewma': round(webhook.latency_ewma, 6) if webhook.latency_ewma is not None else None,
+        'consecutive_failures': webhook.consecutive_failures,
+        'failing_since': webhook.failing_since.isoformat() if webhook.failing_since else None,
+        'last_success_at': webhook.last_success_at.isoformat() if webhook.last_success_at else None,
+        'last_failure_at': webhook.last_failure_at.isoformat() if webhook.last_failure_at else None,
+        'disabled_reason': webhook.disabled_reason
+    }
@@ -0,0 +1,180 @@
+import time
+import logging
+import threading
+from sqlalchemy import event, inspect
+from models import db, WebhookEndpoint, WebhookSubscription
+
+logger = logging.getLogger(__name__)
+
+# Subscribes an endpoint to every event
+WILDCARD = '*'
+
+def parse_events(events):
+    """
+    Validate a list of subscribed event types
+    
+    Accepts exact event types, prefix patterns such as "order.*" (which match
+    "order.created" and "order.item.added") and "*" for every event.
+    
+    Returns:
+        list: The event types, stripped and without duplicates
+    """
+    if not isinstance(events, list):
+        raise ValueError('events must be a list of event types')
+    
+    patterns = []
+    for event_type in events:
+        if not isinstance(event_type, str) or not event_type.strip():
+            raise ValueError('Event types must be non-empty strings')
+        
+        event_type = event_type.strip()
+        if len(event_type) > 128 or ',' in event_type:
+            raise ValueError(f"Invalid event type: {event_type!r}")
+        if '*' in event_type and event_type != WILDCARD and (
+                not event_type.endswith('.*') or '*' in event_type[:-2]):
+            raise ValueError(f"Invalid event pattern: {event_type!r} (wildcards must be a trailing .*)")
+        
+        if event_type not in patterns:
+            patterns.append(event_type)
+    
+    if not patterns:
+        raise ValueError('At least one event type is required')
+    
+    return patterns
+
+def set_subscriptions(webhook, events):
+    """Replace a webhook's subscriptions with the given (already parsed) event types"""
+    existing = {subscription.event_type: subscription for subscription in webhook.subscriptions}
+    
+    webhook.events = ','.join(events)
+    webhook.subscriptions = [
+        existing.get(event_type) or WebhookSubscription(event_type=event_type)
+        for event_type in events
+    ]
+
+def backfill_subscriptions():
+    """
+    Create subscription rows for webhooks saved before subscriptions existed
+    
+    Returns:
+        int: Number of webhooks backfilled
+    """
+    count = 0
+    
+    for webhook in WebhookEndpoint.query.filter(~WebhookEndpoint.subscriptions.any()):
+        events = []
+        for event_type in webhook.events.split(','):
+            try:
+                events.extend(parse_events([event_type]))
+            except ValueError as e:
+                logger.warning(f"Skipping event {event_type!r} of webhook {webhook.id}: {str(e)}")
+        
+        if events:
+            set_subscriptions(webhook, events)
+            count += 1
+    
+    db.session.commit()
+    return count
+
+
+class EventRouter:
+    """In-memory map from event type to subscribed active webhook ids"""
+    
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+        self.catch_all = frozenset()
+        self.loaded_at = None
+        self.dirty = True
+        self._lock = threading.Lock()
+    
+    def invalidate(self):
+        """Force a reload on the next lookup"""
+        self.dirty = True
+    
+    def load(self):
+        """Build the routing map from the subscriptions of active webhooks"""
+        exact, prefixes, catch_all = {}, {}, set()
+        
+        rows = db.session.query(WebhookSubscription.webhook_id, WebhookSubscription.event_type).join(
+            WebhookEndpoint, WebhookEndpoint.id == WebhookSubscription.webhook_id
+        ).filter(WebhookEndpoint.is_active == True)
+        
+        for webhook_id, event_type in rows:
+            if event_type == WILDCARD:
+                catch_all.add(webhook_id)
+            elif event_type.endswith('.*'):
+                # Stored without the * so lookups can slice the event type
+                prefixes.setdefault(event_type[:-1], set()).add(webhook_id)
+            else:
+                exact.setdefault(event_type, set()).add(webhook_id)
+        
+        self.exact, self.prefixes, self.catch_all = exact, prefixes, frozenset(catch_all)
+        logger.info(f"Loaded webhook routes for {len(exact)} events and {len(prefixes)} patterns")
+    
+    def refresh(self, max_age):
+        """Reload the map if it changed locally or is older than max_age seconds"""
+        now = time.monotonic()
+        if not self.dirty and self.loaded_at is not None and now - self.loaded_at < max_age:
+            return
+        
+        with self._lock:
+            if not self.dirty and self.loaded_at is not None and now - self.loaded_at < max_age:
+                return
+            
+            self.dirty = False
+            self.loaded_at = now
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Failed to load webhook routes: {str(e)}")
+    
+    def resolve(self, event_type):
+        """
+        Find the webhooks subscribed to an event without touching the database
+        
+        Looks up the exact event type and each of its dotted prefixes, so the
+        cost grows with the matches and the depth of the name, not the number
+        of subscriptions.
+        
+        Returns:
+            list: Sorted webhook ids
+        """
+        webhook_ids = set(self.catch_all)
+        webhook_ids.update(self.exact.get(event_type, ()))
+        
+        if self.prefixes:
+            position = event_type.find('.')
+            while position != -1:
+                webhook_ids.update(self.prefixes.get(event_type[:position + 1], ()))
+                position = event_type.find('.', position + 1)
+        
+        return sorted(webhook_ids)
+    
+    def stats(self):
+        """Return the size of the routing map"""
+        return {
+            'events': len(self.exact),
+            'patterns': len(self.prefixes),
+            'catch_all': len(self.catch_all)
+        }
+
+
+event_router = EventRouter()
+
+@event.listens_for(WebhookEndpoint, 'after_update')
+def _on_webhook_updated(mapper, connection, target):
+    """Rebuild the routing map when an endpoint is enabled or disabled"""
+    # Health updates from the delivery worker don't affect routing
+    if inspect(target).attrs.is_active.history.has_changes():
+        event_router.invalidate()
+
+
+@event.listens_for(WebhookEndpoint, 'after_insert')
+@event.listens_for(WebhookEndpoint, 'after_delete')
+@event.listens_for(WebhookSubscription, 'after_insert')
+@event.listens_for(WebhookSubscription, 'after_update')
+@event.listens_for(WebhookSubscription, 'after_delete')
+def _on_routes_changed(mapper, connection, target):
+    """Rebuild the routing map after a webhook or subscription is written in this process"""
+    event_router.invalidate()
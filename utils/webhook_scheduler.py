@@ -0,0 +1,153 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest claim in the per-tenant average wait
+WAIT_EWMA_ALPHA = 0.2
+
+# Tenants listed in stats, busiest first
+MAX_REPORTED_TENANTS = 50
+
+class FairScheduler:
+    """
+    Deficit round robin over tenants with due webhook deliveries
+    
+    Every pass each tenant with backlog earns quantum x weight credits and may
+    claim that many deliveries, up to its concurrency cap. Credits a tenant
+    could not use carry over while it still has backlog, so a tenant with a
+    burst gets its share but can never crowd the others out of a pass.
+    """
+    
+    def __init__(self):
+        self.deficits = {}
+        self.tenants = {}
+        self.rounds = 0
+        self._lock = threading.Lock()
+    
+    def allocate(self, backlog, in_flight, slots, config):
+        """
+        Split a pass's delivery slots between tenants
+        
+        Args:
+            backlog: Due deliveries per user id
+            in_flight: Deliveries currently claimed per user id, across workers
+            slots: Deliveries this pass may claim
+            config: App configuration holding quantum, weights and caps
+        
+        Returns:
+            dict: Deliveries to claim per user id
+        """
+        quantum = max(config.get('WEBHOOK_FAIR_QUANTUM', 5), 1)
+        weights = config.get('WEBHOOK_TENANT_WEIGHTS', {})
+        user_cap = config.get('WEBHOOK_USER_CONCURRENCY', 10)
+        
+        with self._lock:
+            # Tenants whose queue drained start from zero next time
+            for user_id in list(self.deficits):
+                if user_id not in backlog:
+                    del self.deficits[user_id]
+            
+            capacity = {
+                user_id: min(count, user_cap - in_flight.get(user_id, 0))
+                for user_id, count in backlog.items()
+            }
+            tenants = sorted(user_id for user_id, room in capacity.items() if room > 0)
+            if not tenants:
+                return {}
+            
+            # Rotate the starting tenant so leftover slots don't always go to the same one
+            start = self.rounds % len(tenants)
+            tenants = tenants[start:] + tenants[:start]
+            self.rounds += 1
+            
+            quotas = {}
+            while slots > 0 and tenants:
+                for user_id in tenants:
+                    deficit = self.deficits.get(user_id, 0) + quantum * max(weights.get(user_id, 1), 0.1)
+                    take = min(int(deficit), capacity[user_id] - quotas.get(user_id, 0), slots)
+                    self.deficits[user_id] = deficit - take
+                    if take:
+                        quotas[user_id] = quotas.get(user_id, 0) + take
+                        slots -= take
+                    if not slots:
+                        break
+                
+                tenants = [user_id for user_id in tenants if quotas.get(user_id, 0) < capacity[user_id]]
+            
+            # A tenant that gets everything it has queued keeps no credit
+            for user_id, quota in quotas.items():
+                if quota >= backlog[user_id]:
+                    self.deficits[user_id] = 0
+        
+        return quotas
+    
+    def settle(self, quotas, claimed):
+        """Give back credit for allocated slots that could not be used (e.g. host caps)"""
+        with self._lock:
+            for user_id, quota in quotas.items():
+                unused = quota - claimed.get(user_id, 0)
+                if unused > 0 and user_id in self.deficits:
+                    self.deficits[user_id] += unused
+    
+    def observe(self, backlog, in_flight, now):
+        """Record each tenant's queue depth and oldest due delivery for this pass"""
+        with self._lock:
+            for user_id, tenant in self.tenants.items():
+                if user_id not in backlog:
+                    tenant['queued'] = 0
+                    tenant['oldest_wait'] = 0.0
+            
+            for user_id, (count, oldest) in backlog.items():
+                tenant = self._tenant(user_id)
+                tenant['queued'] = count
+                tenant['oldest_wait'] = max((now - oldest).total_seconds(), 0.0)
+            
+            for user_id, tenant in self.tenants.items():
+                tenant['in_flight'] = in_flight.get(user_id, 0)
+    
+    def record_claimed(self, deliveries, now):
+        """Record how long claimed deliveries waited after they became due"""
+        with self._lock:
+            for delivery in deliveries:
+                tenant = self._tenant(delivery.user_id)
+                wait = max((now - delivery.next_attempt_at).total_seconds(), 0.0)
+                tenant['claimed'] += 1
+                tenant['avg_wait'] = (1 - WAIT_EWMA_ALPHA) * tenant['avg_wait'] + WAIT_EWMA_ALPHA * wait
+                tenant['max_wait'] = max(tenant['max_wait'], wait)
+    
+    def _tenant(self, user_id):
+        tenant = self.tenants.get(user_id)
+        if tenant is None:
+            tenant = self.tenants[user_id] = {
+                'queued': 0,
+                'in_flight': 0,
+                'oldest_wait': 0.0,
+                'avg_wait': 0.0,
+                'max_wait': 0.0,
+                'claimed': 0
+            }
+        return tenant
+    
+    def stats(self):
+        """Return per-tenant queue depth and wait times, busiest tenants first"""
+        with self._lock:
+            busiest = sorted(self.tenants.items(), key=lambda item: (-item[1]['queued'], item[0]))
+            
+            return {
+                'rounds': self.rounds,
+                'tenants': {
+                    str(user_id): {
+                        'queued': tenant['queued'],
+                        'in_flight': tenant['in_flight'],
+                        'oldest_wait': round(tenant['oldest_wait'], 3),
+                        'avg_wait': round(tenant['avg_wait'], 3),
+                        'max_wait': round(tenant['max_wait'], 3),
+                        'claimed': tenant['claimed']
+                    }
+                    for user_id, tenant in busiest[:MAX_REPORTED_TENANTS]
+                }
+            }
+
+
+fair_scheduler = FairScheduler()